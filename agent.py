@@ -1,21 +1,84 @@
 import os
 import json
 import re
+import time
 import asyncio
+import hashlib
+import importlib.util
 import httpx
+from contextlib import asynccontextmanager
+from collections import deque
 from typing import TypedDict, List, Optional
 from langgraph.graph import StateGraph, END
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from llm_cache import cache_from_env, normalize_text
 
 load_dotenv()
 LOCAL_LLM_BASE_URL = os.getenv('LOCAL_LLM_BASE_URL', 'http://localhost:1234/v1')
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# --- SHARED LLM HTTP CLIENTS ---
+# One long-lived client per backend so extractions reuse warm TCP/TLS connections.
+# The FastAPI app opens/closes them on startup/shutdown; anything else gets them lazily on first use.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2]); fall back to HTTP/1.1 without it
+GEMINI_HTTP2 = os.getenv("GEMINI_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+class LLMClientPool:
+    def __init__(self):
+        self._clients = {}
+        self.stats = {name: {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "saturated": 0, "errors": 0} for name in ("local", "gemini")}
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE, keepalive_expiry=LLM_KEEPALIVE_EXPIRY)
+        return httpx.AsyncClient(limits=limits, http2=(name == "gemini" and GEMINI_HTTP2))
+
+    async def start(self):
+        for name in self.stats:
+            if name not in self._clients: self._clients[name] = self._build(name)
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        if name not in self._clients: self._clients[name] = self._build(name)
+        return self._clients[name]
+
+    @asynccontextmanager
+    async def track(self, name: str):
+        s = self.stats[name]
+        s["requests"] += 1
+        s["in_flight"] += 1
+        s["peak_in_flight"] = max(s["peak_in_flight"], s["in_flight"])
+        # Every connection busy means the next request waits in httpx's pool queue
+        if s["in_flight"] > LLM_MAX_CONNECTIONS: s["saturated"] += 1
+        try:
+            yield self.client(name)
+        except Exception:
+            s["errors"] += 1
+            raise
+        finally:
+            s["in_flight"] -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "max_connections": LLM_MAX_CONNECTIONS,
+            "max_keepalive": LLM_MAX_KEEPALIVE,
+            "gemini_http2": GEMINI_HTTP2,
+            "backends": {name: dict(s) for name, s in self.stats.items()}
+        }
+
+llm_clients = LLMClientPool()
+
 # --- TRUE ASYNC RACE STRATEGY ---
 async def fetch_local_llm(prompt: str) -> str:
-    async with httpx.AsyncClient() as client:
+    async with llm_clients.track("local") as client:
         payload = {"model": "local-model", "messages": [{"role": "user", "content": prompt}], "temperature": 0.0}
         url = f"{LOCAL_LLM_BASE_URL}/chat/completions"
         res = await client.post(url, json=payload, timeout=45.0)
@@ -24,9 +87,8 @@ async def fetch_local_llm(prompt: str) -> str:
 
 async def fetch_gemini(prompt: str) -> str:
     if not GEMINI_API_KEY:
-        await asyncio.sleep(9999) 
-        return ""
-    async with httpx.AsyncClient() as client:
+        raise RuntimeError("GEMINI_API_KEY is not set")
+    async with llm_clients.track("gemini") as client:
         url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
         payload = {
             "contents": [{"parts": [{"text": prompt}]}], 
@@ -40,30 +102,128 @@ async def fetch_gemini(prompt: str) -> str:
         data = res.json()
         return data["candidates"][0]["content"]["parts"][0]["text"].strip()
 
-async def run_llm_race(prompt: str) -> str:
-    task_local = asyncio.create_task(fetch_local_llm(prompt), name="Local_LLM")
-    task_gemini = asyncio.create_task(fetch_gemini(prompt), name="Gemini_LLM")
-    
-    pending = {task_local, task_gemini}
+# --- ADAPTIVE HEDGED RACE ---
+# Send to the backend that has recently been fastest; only fire the other one (a hedge) once the first has
+# run past its own p95, or immediately if it fails. Backends that keep failing are skipped for a cooldown.
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3.0"))
+EWMA_ALPHA = 0.2
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
 
-    while pending:
-        done, pending = await asyncio.wait(
-            pending,
-            return_when=asyncio.FIRST_COMPLETED
-        )
+class BackendHealth:
+    def __init__(self, name: str, fetch, prior_latency: float):
+        self.name = name
+        self.fetch = fetch
+        self.ewma_latency = prior_latency
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def p95(self) -> float:
+        if len(self.samples) < 10: return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def available(self) -> bool:
+        # Past the cooldown the circuit is half-open: the next call is the trial
+        return time.monotonic() >= self.open_until
 
-        for task in done:
-            try:
-                result = task.result()
-                for p in pending:
-                    p.cancel()
-                return result
-            except Exception as e:
-                print(f"[{task.get_name()}] failed: {type(e).__name__} - {str(e)}. Falling back...")
-                if not pending:
-                    raise Exception("Both LLMs failed. Check your Local LLM server and Gemini API Key.")
+    def record_success(self, latency: float):
+        self.samples.append(latency)
+        self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_cancelled(self, elapsed: float):
+        # Lost a hedge race: the real latency is at least `elapsed`, so only let it pull the estimate up.
+        # Without this a backend that always loses would keep its prior and stay ranked first.
+        self.samples.append(elapsed)
+        self.ewma_latency = max(self.ewma_latency, EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.ewma_latency)
+
+    def record_failure(self):
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + CIRCUIT_COOLDOWN
+
+    async def call(self, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            result = await self.fetch(prompt)
+        except asyncio.CancelledError:
+            self.record_cancelled(time.monotonic() - started)
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "ewma_latency": round(self.ewma_latency, 3), "p95": round(self.p95(), 3), "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures, "circuit_open": not self.available()
+        }
 
-    raise Exception("All LLM tasks failed unexpectedly.")
+# The free local model starts slightly ahead so Gemini is only the hedge until it proves faster
+llm_backends = {
+    "local": BackendHealth("Local_LLM", fetch_local_llm, prior_latency=1.0),
+    "gemini": BackendHealth("Gemini_LLM", fetch_gemini, prior_latency=1.5),
+}
+
+def ranked_backends() -> list:
+    enabled = [b for name, b in llm_backends.items() if name != "gemini" or GEMINI_API_KEY]
+    # If every circuit is open, try them all anyway rather than failing outright
+    candidates = [b for b in enabled if b.available()] or enabled
+    return sorted(candidates, key=lambda b: b.ewma_latency * (1 + b.error_rate))
+
+async def run_llm_race(prompt: str) -> str:
+    queue = ranked_backends()
+    running = {}
+    last_error = None
+    try:
+        while queue or running:
+            if queue and not running:
+                backend = queue.pop(0)
+                running[asyncio.create_task(backend.call(prompt), name=backend.name)] = backend
+            # Hedge timer is the p95 of the slowest-started backend still in flight
+            hedge_after = max(b.p95() for b in running.values()) if queue else None
+            done, _ = await asyncio.wait(running, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                backend = queue.pop(0)
+                running[asyncio.create_task(backend.call(prompt), name=backend.name)] = backend
+                continue
+            for task in done:
+                running.pop(task)
+                try:
+                    return task.result()
+                except Exception as e:
+                    last_error = e
+                    print(f"[{task.get_name()}] failed: {type(e).__name__} - {str(e)}. Falling back...")
+    finally:
+        for task in running:
+            task.cancel()
+    raise Exception(f"Both LLMs failed. Check your Local LLM server and Gemini API Key. Last error: {last_error}")
+
+# --- SINGLE-FLIGHT ---
+# Identical concurrent requests (e.g. a campaign burst) share one in-flight race instead of each starting their own.
+_in_flight = {}
+single_flight_stats = {"leaders": 0, "followers": 0}
+
+async def single_flight(key: str, make_coro):
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    task = _in_flight.get(digest)
+    if task is None:
+        single_flight_stats["leaders"] += 1
+        task = asyncio.create_task(make_coro())
+        _in_flight[digest] = task
+        task.add_done_callback(lambda t: _in_flight.pop(digest, None) if _in_flight.get(digest) is t else None)
+    else:
+        single_flight_stats["followers"] += 1
+    # Shield so one impatient caller being cancelled does not cancel the race for everyone else
+    return await asyncio.shield(task)
 
 # --- DATE CALCULATOR ---
 def calculate_exact_datetime(raw_date_text, raw_time_text, current_time_str):
@@ -106,6 +266,84 @@ def calculate_exact_datetime(raw_date_text, raw_time_text, current_time_str):
 
     return final_date, final_time
 
+extraction_cache = cache_from_env("extraction", default_ttl=7 * 86400)
+
+# --- DETERMINISTIC FAST PATH ---
+# Rule-based pre-parser for the common booking phrases. It emits the same JSON shape as the LLM prompt,
+# plus a confidence score; anything it cannot fully account for falls through to the LLM race.
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+WEEKDAYS = {"monday": "monday", "mon": "monday", "tuesday": "tuesday", "tue": "tuesday", "tues": "tuesday",
+            "wednesday": "wednesday", "wed": "wednesday", "thursday": "thursday", "thu": "thursday", "thur": "thursday", "thurs": "thursday",
+            "friday": "friday", "fri": "friday", "saturday": "saturday", "sat": "saturday", "sunday": "sunday", "sun": "sunday"}
+SYMPTOMS = ["sore throat", "runny nose", "stomach ache", "back pain", "chest pain", "body ache", "check up", "checkup", "medical check",
+            "fever", "cough", "flu", "cold", "headache", "migraine", "diarrhea", "diarrhoea", "vomiting", "nausea", "rash",
+            "allergy", "asthma", "dizziness", "dizzy", "toothache", "sprain", "injury", "infection", "pain"]
+FILLER_WORDS = set("""i m me my we our im want wanna would like to book booking make schedule reserve an a the appointment appt slot
+please pls plz can could you see visit doctor dr doc clinic with and or at on for around about by this is it possible
+need have got feel feeling having sick unwell hi hello hey thanks thank consultation because of due since bit some
+next coming an time date day""".split())
+# Only redundant once an exact time / a doctor preference was parsed; on their own they carry information the rules drop
+TIME_OF_DAY_WORDS = {"morning", "afternoon", "evening", "night"}
+DOCTOR_WORDS = {"doctor", "dr", "doc"}
+# The word after one of these is a doctor's name (or who the visit is for) unless it is one of NOT_A_NAME
+NAME_MARKERS = DOCTOR_WORDS | {"with"}
+NOT_A_NAME = {"a", "an", "the", "at", "on", "for", "by", "around", "about", "in", "to", "and", "or", "please", "pls", "plz"}
+QUESTION_WORDS = {"where", "what", "when", "how", "why", "which", "who", "do", "does", "is", "are"}
+fast_path_stats = {"fast": 0, "fallback": 0}
+
+def fast_parse_appointment(user_text: str):
+    text = normalize_text(user_text)
+    data = {"intent": "booking", "raw_date_text": None, "raw_time_text": None, "doctor_preference": None, "general_notes": None}
+
+    def take(pattern):
+        nonlocal text
+        match = re.search(pattern, text)
+        if match: text = (text[:match.start()] + " " + text[match.end():]).strip()
+        return match
+
+    if take(r"\bday after (?:tomorrow|tmr|tmrw)\b"): data["raw_date_text"] = "in 2 days"
+    elif m := take(r"\b\d{4}-\d{2}-\d{2}\b"): data["raw_date_text"] = m.group(0)
+    elif m := take(r"\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b"): data["raw_date_text"] = m.group(0)
+    elif take(r"\b(?:today|tonight)\b"): data["raw_date_text"] = "today"
+    elif take(r"\b(?:tomorrow|tmr|tmrw|tomorow)\b"): data["raw_date_text"] = "tomorrow"
+    elif m := take(r"\bin (\d+) days?\b"): data["raw_date_text"] = f"in {m.group(1)} days"
+    elif m := take(r"\b(next |this |coming )?(" + "|".join(sorted(WEEKDAYS, key=len, reverse=True)) + r")\b"):
+        data["raw_date_text"] = f"{'next ' if (m.group(1) or '').strip() == 'next' else ''}{WEEKDAYS[m.group(2)]}"
+
+    if m := take(r"\b(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)\b"): data["raw_time_text"] = f"{m.group(1)}:{m.group(2) or '00'} {m.group(3)}"
+    elif m := take(r"\b(\d{1,2})[:.](\d{2})\b"): data["raw_time_text"] = f"{m.group(1)}:{m.group(2)}"
+    elif take(r"\bnoon\b"): data["raw_time_text"] = "12:00 pm"
+
+    if take(r"\b(?:female|lady|woman)\b"): data["doctor_preference"] = "FEMALE"
+    elif take(r"\b(?:male|man|gentleman)\b"): data["doctor_preference"] = "MALE"
+
+    found = []
+    for symptom in SYMPTOMS:
+        if take(r"\b" + re.escape(symptom) + r"\b"): found.append(symptom)
+    if found: data["general_notes"] = ", ".join(found)
+
+    question = "?" in str(user_text) or (text.split()[:1] and text.split()[0] in QUESTION_WORDS)
+    if take(r"\bcancel(?:led|ling|lation)?\b"): data["intent"] = "cancel"
+    elif take(r"\b(?:reschedule|rescheduling|postpone|change|move)\b"): data["intent"] = "reschedule"
+    elif question and not (data["raw_date_text"] or data["raw_time_text"]): data["intent"] = "question"
+
+    # Every leftover word must be accounted for: one unexplained word (a name, "vaccine", "my son", "knee") is
+    # information the rules would silently drop, so the message goes to the LLM instead
+    words = [w.strip(".") for w in text.split()]
+    def explained(i, w):
+        if i > 0 and words[i - 1] in NAME_MARKERS and w not in NOT_A_NAME: return False
+        if w in TIME_OF_DAY_WORDS: return bool(data["raw_time_text"])
+        if w in DOCTOR_WORDS: return bool(data["doctor_preference"])
+        return w in FILLER_WORDS or w in QUESTION_WORDS
+    if not all(explained(i, w) for i, w in enumerate(words)): return data, 0.0
+    if data["intent"] in ["cancel", "reschedule"]: confidence = 0.9
+    elif data["intent"] == "question": confidence = 0.85
+    elif data["raw_date_text"] and data["raw_time_text"]: confidence = 1.0
+    elif data["raw_date_text"] or data["raw_time_text"]: confidence = 0.85
+    else: confidence = 0.3
+    return data, confidence
+
+
 class AppointmentExtraction(BaseModel):
     intent: str
     date_preference: Optional[str] = None
@@ -130,9 +368,19 @@ async def extract_appointment_details(user_text: str, current_time_str: str):
     Note: If the user is asking a general question not related to booking an appointment (e.g. "Where is the clinic?", "What are your hours?", "Can I bring my child?"), set intent to "question".
     """
     try:
-        raw_text = await run_llm_race(prompt)
-        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-        llm_data = json.loads(json_match.group(0)) if json_match else json.loads(raw_text)
+        llm_data, confidence = fast_parse_appointment(user_text)
+        if confidence >= FAST_PATH_MIN_CONFIDENCE:
+            fast_path_stats["fast"] += 1
+        else:
+            fast_path_stats["fallback"] += 1
+            # Cached JSON keeps raw_date_text/raw_time_text relative ("tomorrow"), so it is still resolved against now below
+            cache_key = normalize_text(user_text)
+            llm_data = await extraction_cache.aget(cache_key)
+        if llm_data is None:
+            raw_text = await single_flight(f"extract:{cache_key}", lambda: run_llm_race(prompt))
+            json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
+            llm_data = json.loads(json_match.group(0)) if json_match else json.loads(raw_text)
+            await extraction_cache.aput(cache_key, llm_data)
         
         calculated_date, calculated_time = calculate_exact_datetime(llm_data.get("raw_date_text"), llm_data.get("raw_time_text"), current_time_str)
         return AppointmentExtraction(
@@ -166,7 +414,7 @@ async def generate_vaccine_schedule_ai(search_query: str):
     }}
     """
     try:
-        raw_text = await run_llm_race(prompt)
+        raw_text = await single_flight(f"vaccine:{normalize_text(search_query)}", lambda: run_llm_race(prompt))
         json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
         return json.loads(json_match.group(0)) if json_match else json.loads(raw_text)
     except Exception as e:
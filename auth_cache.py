@@ -0,0 +1,55 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+
+# --- PRINCIPAL CACHE ---
+# get_current_user resolves (sub, clinic_id) to the user's staff role/status on every authenticated request.
+# The result is cached for a few seconds; routes that change staff rows, roles or ICs drop the affected entries.
+class PrincipalCache:
+    """LRU + TTL cache of resolved principals keyed by (sub, clinic_id). Values are plain dicts, never ORM objects."""
+    def __init__(self, maxsize: int = 4096, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sub: str, clinic_id) -> Optional[dict]:
+        key = (str(sub), str(clinic_id))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None: del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, sub: str, clinic_id, principal: dict):
+        key = (str(sub), str(clinic_id))
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, principal)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, sub: str = None, clinic_id=None):
+        """Drops every entry matching the given sub and/or clinic; with neither, clears everything."""
+        sub = str(sub) if sub is not None else None
+        clinic_id = str(clinic_id) if clinic_id is not None else None
+        with self._lock:
+            for key in [k for k in self._data if (sub is None or k[0] == sub) and (clinic_id is None or k[1] == clinic_id)]:
+                del self._data[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+principal_cache = PrincipalCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_MAXSIZE", "4096")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30")),
+)
@@ -0,0 +1,190 @@
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date, time, timedelta
+from collections import OrderedDict
+from functools import lru_cache
+from time import monotonic
+from typing import Dict, Iterable, List
+from ttl_cache import TTLCache
+
+# --- BITSET SLOT ENGINE ---
+# A doctor-day is a Python int used as a 1440-bit bitmap: bit i is minute i of the day.
+# Python ints give us arbitrary-width AND/OR/shift in C, so a whole day is a handful of ops.
+MINUTES_PER_DAY = 24 * 60
+
+def minute_of(t) -> int:
+    return t.hour * 60 + t.minute
+
+def window_mask(start_min: int, end_min: int) -> int:
+    if end_min <= start_min: return 0
+    return ((1 << (end_min - start_min)) - 1) << start_min
+
+@lru_cache(maxsize=4096)
+def grid_mask(start_min: int, end_min: int, step: int) -> int:
+    """Candidate slot starts: start, start+step, ... while < end (same grid the bot has always offered)."""
+    mask = 0
+    for m in range(start_min, end_min, step):
+        mask |= 1 << m
+    return mask
+
+def spread_back(mask: int, width: int) -> int:
+    """Bit i is set if any bit in [i, i+width) of mask is set. O(log width) shifts."""
+    covered = 1
+    while covered < width:
+        step = min(covered, width - covered)
+        mask |= mask >> step
+        covered += step
+    return mask
+
+def future_mask(day: date, now: datetime) -> int:
+    if day < now.date(): return 0
+    if day > now.date(): return (1 << MINUTES_PER_DAY) - 1
+    # A slot at hh:mm:00 must be strictly later than now
+    first = minute_of(now) + 1
+    return window_mask(first, MINUTES_PER_DAY)
+
+def iter_bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def busy_mask(busy_times: Iterable[datetime]) -> int:
+    mask = 0
+    for t in busy_times:
+        mask |= 1 << minute_of(t)
+    return mask
+
+def free_slot_mask(windows: Iterable[tuple], busy: int, duration: int, allowed: int) -> int:
+    """windows are (start_min, end_min) pairs; busy has a bit at every booked start minute.
+    A slot is free if no existing booking starts inside [slot, slot + duration)."""
+    starts = 0
+    for start_min, end_min in windows:
+        starts |= grid_mask(start_min, end_min, duration)
+    if not starts: return 0
+    return starts & allowed & ~spread_back(busy, duration)
+
+def slots_for_day(day: date, windows: Iterable[tuple], busy_times: Iterable[datetime], duration: int, now: datetime) -> List[datetime]:
+    mask = free_slot_mask(windows, busy_mask(busy_times), duration, future_mask(day, now))
+    base = datetime.combine(day, time.min)
+    return [base + timedelta(minutes=m) for m in iter_bits(mask)]
+
+def day_code(day: date) -> str:
+    return day.strftime("%a").lower()[:3]
+
+# --- PER-DAY FREE CAPACITY SUMMARIES ---
+class DaySummaryStore:
+    """Free-slot counts per (clinic_id, duration, doctor_pref) and day.
+    Writes drop only the clinic-days they touch, so a refresh recomputes just those days.
+    doctor_pref is client input, so keys are bounded like SlotCache: LRU past maxsize, and a key's counts are
+    dropped ttl seconds after it was first filled."""
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _counts(self, key: tuple) -> Dict[date, int]:
+        entry = self._data.get(key)
+        if entry is None: return {}
+        if entry[0] < monotonic():
+            del self._data[key]
+            return {}
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def missing(self, key: tuple, days: List[date], today: date) -> List[date]:
+        with self._lock:
+            counts = self._counts(key)
+            # Today's count shrinks as the clock passes slots, so it is never served from the summary
+            return [d for d in days if d == today or d not in counts]
+
+    def update(self, key: tuple, counts: Dict[date, int]):
+        with self._lock:
+            if not self._counts(key): self._data[key] = (monotonic() + self.ttl, {})
+            self._data[key][1].update(counts)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def free_days(self, key: tuple, days: List[date]) -> List[date]:
+        with self._lock:
+            counts = self._counts(key)
+            return [d for d in days if counts.get(d, 0) > 0]
+
+    def invalidate(self, clinic_id: str, *days: date):
+        clinic_id = str(clinic_id)
+        with self._lock:
+            for key, (_, counts) in self._data.items():
+                if key[0] != clinic_id: continue
+                if not days: counts.clear()
+                for d in days: counts.pop(d, None)
+
+def pref_key(doctor_pref) -> str:
+    return str(doctor_pref or "ANY").strip().upper()
+
+# invalidate() only reaches this process, so the TTL bounds how long another worker's booking can go unseen
+day_summaries = DaySummaryStore(
+    maxsize=int(os.getenv("DAY_SUMMARY_MAXSIZE", "1024")),
+    ttl=float(os.getenv("DAY_SUMMARY_TTL_SECONDS", "60")),
+)
+
+# --- SLOT CACHE ---
+class SlotCache(TTLCache):
+    """LRU + TTL cache of per-day doctor slots keyed by (clinic_id, date, duration, doctor_pref).
+    Entries are plain dicts (never ORM objects) so they are safe to share across sessions."""
+    def __init__(self, maxsize: int = 2048, ttl: float = 60.0):
+        super().__init__(maxsize, ttl)
+
+    def invalidate(self, clinic_id: str, *days: date):
+        clinic_id = str(clinic_id)
+        self.invalidate_where(lambda k: k[0] == clinic_id and (not days or k[1] in days))
+
+slot_cache = SlotCache(
+    maxsize=int(os.getenv("SLOT_CACHE_MAXSIZE", "2048")),
+    ttl=float(os.getenv("SLOT_CACHE_TTL_SECONDS", "60")),
+)
+
+# --- NEAREST FREE SLOT INDEX ---
+class FreeSlotIndex:
+    """Sorted free slot starts for a clinic across several days.
+    Per-doctor arrays answer "who is free at T"; a merged array answers "k nearest starts to T" in O(log n + k)."""
+    def __init__(self, doc_slots: Dict[str, List[datetime]], doc_names: Dict[str, str]):
+        self.doc_names = doc_names
+        self._by_doc = {ic: sorted(slots) for ic, slots in doc_slots.items() if slots}
+        self._all = sorted({s for slots in self._by_doc.values() for s in slots})
+
+    def doctors_free_at(self, t: datetime) -> List[str]:
+        free = []
+        for ic, starts in self._by_doc.items():
+            i = bisect_left(starts, t)
+            if i < len(starts) and starts[i] == t: free.append(ic)
+        return free
+
+    def count_on_day(self, ic: str, day: date) -> int:
+        starts = self._by_doc.get(ic, [])
+        day_start = datetime.combine(day, time.min)
+        return bisect_left(starts, day_start + timedelta(days=1)) - bisect_left(starts, day_start)
+
+    def nearest(self, t: datetime, k: int, after: datetime) -> List[datetime]:
+        starts = self._all
+        hi = bisect_left(starts, t)
+        lo = hi - 1
+        floor = bisect_right(starts, after)
+        if hi < floor: hi = floor
+        result = []
+        while len(result) < k:
+            has_lo = lo >= floor
+            has_hi = hi < len(starts)
+            if not has_lo and not has_hi: break
+            if has_hi and (not has_lo or starts[hi] - t < t - starts[lo]):
+                result.append(starts[hi]); hi += 1
+            else:
+                result.append(starts[lo]); lo -= 1
+        return result
+
+index_cache = SlotCache(
+    maxsize=int(os.getenv("SLOT_INDEX_CACHE_MAXSIZE", "256")),
+    ttl=float(os.getenv("SLOT_CACHE_TTL_SECONDS", "60")),
+)
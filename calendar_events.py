@@ -0,0 +1,162 @@
+import os
+import threading
+from datetime import timedelta
+from time import monotonic
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+import models
+
+# --- CALENDAR READ MODEL ---
+# One pre-rendered calendar_events row per appointment stage. Every write path that changes what the
+# dashboard shows calls refresh_appointments() before committing, so /admin/appointments is a single scan.
+EVENT_LENGTH = timedelta(minutes=30)
+# How often a clinic's events are re-checked against its stages (catches writers that bypass refresh_appointments)
+CALENDAR_VERIFY_SECONDS = float(os.getenv("CALENDAR_VERIFY_SECONDS", "300"))
+
+_verified_clinics = {}
+_verified_lock = threading.Lock()
+
+def render_events(db: Session, appointments: list) -> list:
+    appt_ids = [a.id for a in appointments]
+    if not appt_ids: return []
+
+    stages = db.query(models.ApptStage).filter(models.ApptStage.appointment_id.in_(appt_ids)).all()
+
+    patient_ics = list({a.patient_ic for a in appointments if a.patient_ic})
+    patients = db.query(models.Patient).filter(models.Patient.ic_passport_number.in_(patient_ics)).all() if patient_ics else []
+    patient_dict = {str(p.ic_passport_number): p for p in patients}
+
+    doctor_ics = list({a.doctor_ic for a in appointments if a.doctor_ic})
+    doctors = db.query(models.Doctor).filter(models.Doctor.ic_passport_number.in_(doctor_ics)).all() if doctor_ics else []
+    doctor_dict = {str(d.ic_passport_number): d for d in doctors}
+
+    # Only the vaccines/tests these appointments reference, not every row across all clinics
+    appt_vaccines = db.query(models.AppointmentVaccine, models.Vaccine.name).outerjoin(
+        models.Vaccine, models.Vaccine.id == models.AppointmentVaccine.vaccine_id
+    ).filter(models.AppointmentVaccine.appointment_id.in_(appt_ids)).all()
+    appt_tests = db.query(models.AppointmentBloodTest, models.BloodTest.name).outerjoin(
+        models.BloodTest, models.BloodTest.id == models.AppointmentBloodTest.blood_test_id
+    ).filter(models.AppointmentBloodTest.appointment_id.in_(appt_ids)).all()
+
+    vac_dict = {}
+    for av, v_name in appt_vaccines:
+        vac_dict.setdefault(str(av.appointment_id), []).append((av, v_name or "Unknown Vaccine"))
+    test_dict = {}
+    for at, t_name in appt_tests:
+        test_dict.setdefault(str(at.appointment_id), []).append(t_name or "Unknown Test")
+
+    appt_dict = {str(a.id): a for a in appointments}
+    events = []
+    for stage in stages:
+        if not stage.scheduled_time: continue
+        appt = appt_dict.get(str(stage.appointment_id))
+        if not appt: continue
+
+        patient = patient_dict.get(str(appt.patient_ic))
+        doctor = doctor_dict.get(str(appt.doctor_ic)) if appt.doctor_ic else None
+
+        key = str(appt.id)
+        items_list = []
+        dose_val = stage.stage_name
+
+        service = "Consultation"
+        color = "#3B82F6"
+
+        if key in vac_dict:
+            service = "Vaccine"
+            color = "#A855F7"
+            for av, v_name in vac_dict[key]:
+                items_list.append(v_name)
+                dose_val = stage.stage_name if stage.stage_name.startswith("Dose") else av.dose_number
+        elif key in test_dict:
+            service = "Blood Test"
+            color = "#EF4444"
+            items_list.extend(test_dict[key])
+        else:
+            if appt.appt_type == "follow-up": color = "#F97316"
+
+        patient_name = patient.name if patient else 'Unknown Patient'
+
+        events.append(models.CalendarEvent(
+            stage_id=stage.id,
+            appointment_id=appt.id,
+            clinic_id=appt.clinic_id,
+            scheduled_time=stage.scheduled_time,
+            title=f"{patient_name} - {service}",
+            patient_name=patient_name,
+            patient_ic=patient.ic_passport_number if patient else "",
+            doctor_name=doctor.name if doctor else "Unassigned",
+            doctor_ic=str(doctor.ic_passport_number) if doctor else "",
+            appt_type=appt.appt_type,
+            service=service,
+            items=items_list,
+            stage_name=stage.stage_name,
+            # Only the vaccine's own dose_number is stored; serialize falls back to the stage name
+            dose=None if dose_val is stage.stage_name else dose_val,
+            total_doses=appt.total_stages,
+            reason=appt.general_notes or "",
+            status=stage.status,
+            color=color,
+            cancel_reason=stage.cancel_reason
+        ))
+    return events
+
+def refresh_appointments(db: Session, appt_ids) -> None:
+    """Re-render the events of the given appointments. Flushes but does not commit."""
+    appt_ids = list({a for a in appt_ids if a})
+    if not appt_ids: return
+    db.flush()
+    db.query(models.CalendarEvent).filter(models.CalendarEvent.appointment_id.in_(appt_ids)).delete(synchronize_session=False)
+    appointments = db.query(models.Appointment).filter(models.Appointment.id.in_(appt_ids)).all()
+    db.add_all(render_events(db, appointments))
+    db.flush()
+
+def rebuild_clinic(db: Session, clinic_id: str) -> None:
+    db.query(models.CalendarEvent).filter(models.CalendarEvent.clinic_id == clinic_id).delete(synchronize_session=False)
+    appointments = db.query(models.Appointment).filter(models.Appointment.clinic_id == clinic_id).all()
+    db.add_all(render_events(db, appointments))
+    db.commit()
+
+def fingerprint(stage_id, scheduled_time, status):
+    """md5 over every (stage id, time, status) in id order: differs if any row is missing, extra or out of date."""
+    row = func.concat(stage_id, "|", scheduled_time, "|", status)
+    return func.md5(func.string_agg(row, aggregate_order_by(",", stage_id)))
+
+def ensure_clinic(db: Session, clinic_id: str) -> None:
+    """Rebuild a clinic's events if they drifted from its stages (rows written before the read model existed, or by
+    a writer that did not refresh them). Checked at most every CALENDAR_VERIFY_SECONDS per clinic and process."""
+    with _verified_lock:
+        if monotonic() - _verified_clinics.get(clinic_id, float("-inf")) < CALENDAR_VERIFY_SECONDS: return
+    stages = db.query(fingerprint(models.ApptStage.id, models.ApptStage.scheduled_time, models.ApptStage.status)).join(models.Appointment).filter(
+        models.Appointment.clinic_id == clinic_id, models.ApptStage.scheduled_time.isnot(None)
+    ).scalar()
+    events = db.query(fingerprint(models.CalendarEvent.stage_id, models.CalendarEvent.scheduled_time, models.CalendarEvent.status)).filter(
+        models.CalendarEvent.clinic_id == clinic_id
+    ).scalar()
+    if stages != events: rebuild_clinic(db, clinic_id)
+    with _verified_lock:
+        _verified_clinics[clinic_id] = monotonic()
+
+def serialize(e: models.CalendarEvent) -> dict:
+    return {
+        "id": str(e.stage_id),
+        "appt_id": str(e.appointment_id),
+        "title": e.title,
+        "patient_name": e.patient_name,
+        "stage_name": e.stage_name,
+        "start": e.scheduled_time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "end": (e.scheduled_time + EVENT_LENGTH).strftime("%Y-%m-%dT%H:%M:%S"),
+        "patient_ic": e.patient_ic,
+        "doctor": e.doctor_name,
+        "doctor_ic": e.doctor_ic,
+        "type": e.appt_type,
+        "service": e.service,
+        "items": e.items or [],
+        "dose": e.dose if e.dose is not None else e.stage_name,
+        "total_doses": e.total_doses,
+        "reason": e.reason,
+        "status": e.status,
+        "color": e.color,
+        "cancel_reason": e.cancel_reason
+    }
@@ -1,76 +1,140 @@
 import os
-import httpx
+import asyncio
 import logging
 from celery import Celery
-from celery.schedules import crontab
+from celery.signals import worker_init
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import select, update, func, or_
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, get_engine
 import models
+import outbox
 from dotenv import load_dotenv
 
 load_dotenv()
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+# Reminders go out once a stage enters each lead window (minutes before the clinic-local appointment time).
+# Each tick claims only what became due since the last one, so sends are spread across the day.
+REMINDER_LEAD_MINUTES = sorted({int(m) for m in os.getenv("REMINDER_LEAD_MINUTES", "1440,120").split(",") if m.strip()})
+REMINDER_TICK_SECONDS = int(os.getenv("REMINDER_TICK_SECONDS", "60"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "200"))
+OUTBOX_POLL_SECONDS = int(os.getenv("OUTBOX_POLL_SECONDS", "5"))
 
 celery_app = Celery("clinic_tasks", broker="redis://localhost:6379/0")
 
-# Run the Reminder Agent daily at 8:00 AM
+# Run the Reminder Agent every tick; a tick that is still queued when the next one fires is dropped
 celery_app.conf.beat_schedule = {
-    'daily-reminder-agent': {
+    'rolling-reminder-agent': {
         'task': 'celery_worker.run_reminder_agent',
-        'schedule': crontab(hour=8, minute=0),
+        'schedule': REMINDER_TICK_SECONDS,
+        'options': {'expires': REMINDER_TICK_SECONDS},
+    },
+    # Picks up retries and anything the API processes enqueued but did not send inline
+    'outbox-dispatcher': {
+        'task': 'celery_worker.dispatch_outbox',
+        'schedule': OUTBOX_POLL_SECONDS,
+        'options': {'expires': OUTBOX_POLL_SECONDS},
     },
 }
 
-@celery_app.task
-def run_reminder_agent():
-    """Reminder Agent: Scans for appointments tomorrow and notifies patients."""
-    db: Session = SessionLocal()
-    tomorrow_start = datetime.now().replace(hour=0, minute=0, second=0) + timedelta(days=1)
-    tomorrow_end = tomorrow_start + timedelta(days=1)
-
+@worker_init.connect
+def prepare_schema(**kwargs):
+    # The reminder agent needs appointment_stages.reminder_sent even if the API has not started yet
     try:
-        # Find all appt_stages scheduled for tomorrow
-        upcoming_stages = db.query(models.ApptStage, models.Appointment, models.Patient).join(
-            models.Appointment, models.ApptStage.appointment_id == models.Appointment.id
-        ).join(
-            models.Patient, models.Appointment.patient_ic == models.Patient.ic_passport_number
-        ).filter(
-            models.ApptStage.scheduled_time >= tomorrow_start,
-            models.ApptStage.scheduled_time < tomorrow_end,
-            models.ApptStage.status == 'scheduled'
-        ).all()
+        models.ensure_schema(get_engine())
+    except Exception as e:
+        logging.error(f"Schema check failed: {e}")
 
-        for stage, appt, patient in upcoming_stages:
-            if not patient.telegram_id: continue
+def lead_label(lead: int) -> str:
+    return f"{lead // 60}h" if lead % 60 == 0 else f"{lead}m"
 
-            # Format the Reminder Message
-            msg = (f"🔔 *Appointment Reminder*\n\n"
-                   f"Hello {patient.name}, this is a reminder for your upcoming clinic visit.\n\n"
-                   f"Service: {stage.stage_name}\n"
-                   f"Date: {stage.scheduled_time.strftime('%Y-%m-%d')}\n"
-                   f"Time: {stage.scheduled_time.strftime('%H:%M %p')}\n\n"
-                   f"Please reply 'Confirm' or use /status to reschedule.")
+def clinic_timezones(db: Session) -> list:
+    return [tz for (tz,) in db.query(func.coalesce(models.Clinic.timezone, models.DEFAULT_TIMEZONE)).distinct()]
 
-            # Send via Telegram API
-            response = httpx.post(TELEGRAM_API_URL, json={
-                "chat_id": patient.telegram_id,
-                "text": msg,
-                "parse_mode": "Markdown"
-            })
+def claim_due_reminders(db: Session, tz: str, lead: int) -> list:
+    """Atomically mark up to REMINDER_BATCH_SIZE stages in clinics on `tz` that are now within `lead` minutes and
+    have not had this (or a closer) reminder yet, and return the message columns for them.
+    SKIP LOCKED lets overlapping ticks or several workers claim disjoint sets. The caller commits the claim together
+    with the outbox rows, so a crash either loses both or keeps both and a rerun never double-sends."""
+    now = datetime.now(ZoneInfo(tz)).replace(tzinfo=None)
+    due = select(models.ApptStage.id).join(
+        models.Appointment, models.ApptStage.appointment_id == models.Appointment.id
+    ).join(
+        models.Clinic, models.Appointment.clinic_id == models.Clinic.id
+    ).join(
+        models.Patient, models.Appointment.patient_ic == models.Patient.ic_passport_number
+    ).where(
+        func.coalesce(models.Clinic.timezone, models.DEFAULT_TIMEZONE) == tz,
+        models.ApptStage.scheduled_time > now,
+        models.ApptStage.scheduled_time <= now + timedelta(minutes=lead),
+        models.ApptStage.status == 'scheduled',
+        or_(models.ApptStage.reminder_sent.is_(None), models.ApptStage.reminder_sent > lead),
+        models.Patient.telegram_id.isnot(None)
+    ).limit(REMINDER_BATCH_SIZE).with_for_update(of=models.ApptStage, skip_locked=True)
 
-            if response.status_code == 200:
-                # Log the agent's action
-                log = models.AgentLog(
-                    clinic_id=appt.clinic_id, 
-                    action="Reminder Sent", 
-                    reasoning=f"Sent automated 1-day reminder to {patient.ic_passport_number} for stage {stage.id}"
-                )
-                db.add(log)
-        db.commit()
+    claimed = db.execute(
+        update(models.ApptStage).where(models.ApptStage.id.in_(due.scalar_subquery()))
+        .values(reminder_sent=lead).returning(models.ApptStage.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    rows = []
+    if claimed:
+        rows = db.query(
+            models.ApptStage.id, models.ApptStage.stage_name, models.ApptStage.scheduled_time,
+            models.Appointment.clinic_id, models.Patient.ic_passport_number, models.Patient.name, models.Patient.telegram_id
+        ).join(
+            models.Appointment, models.ApptStage.appointment_id == models.Appointment.id
+        ).join(
+            models.Patient, models.Appointment.patient_ic == models.Patient.ic_passport_number
+        ).filter(models.ApptStage.id.in_(claimed)).all()
+    return rows
 
+def queue_reminder(db: Session, row, lead: int) -> dict:
+    stage_id, stage_name, scheduled_time, clinic_id, patient_ic, patient_name, telegram_id = row
+    # Format the Reminder Message
+    msg = (f"🔔 *Appointment Reminder*\n\n"
+           f"Hello {patient_name}, this is a reminder for your upcoming clinic visit.\n\n"
+           f"Service: {stage_name}\n"
+           f"Date: {scheduled_time.strftime('%Y-%m-%d')}\n"
+           f"Time: {scheduled_time.strftime('%H:%M %p')}\n\n"
+           f"Please reply 'Confirm' or use /status to reschedule.")
+    outbox.enqueue(db, "telegram", telegram_id, msg, clinic_id=clinic_id)
+    # Committed with the outbox row, which delivers it; keeps the action name the agent log has always used
+    return {
+        "clinic_id": clinic_id,
+        "action": "Reminder Sent",
+        "reasoning": f"Sent automated {lead_label(lead)} reminder to {patient_ic} for stage {stage_id}",
+        "timestamp": datetime.utcnow()
+    }
+
+@celery_app.task
+def run_reminder_agent():
+    """Reminder Agent: Every tick, claims the stages that just entered a reminder lead window and queues the messages.
+    Closer leads go first, so a stage already inside the 2h window gets only the 2h reminder, not a late 24h one too."""
+    db: Session = SessionLocal()
+    queued = 0
+    try:
+        timezones = clinic_timezones(db)
+        for lead in REMINDER_LEAD_MINUTES:
+            for tz in timezones:
+                while True:
+                    rows = claim_due_reminders(db, tz, lead)
+                    if not rows: break
+                    db.bulk_insert_mappings(models.AgentLog, [queue_reminder(db, r, lead) for r in rows])
+                    db.commit()
+                    queued += len(rows)
+        if queued:
+            logging.info(f"Reminder Agent queued {queued} reminders")
+            dispatch_outbox.delay()
     except Exception as e:
+        db.rollback()
         logging.error(f"Reminder Agent failed: {e}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@celery_app.task
+def dispatch_outbox():
+    """Sends everything due in the outbox (new messages and retries) for up to OUTBOX_DRAIN_SECONDS."""
+    sent = asyncio.run(outbox.drain())
+    if sent: logging.info(f"Outbox dispatcher processed {sent} messages")
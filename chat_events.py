@@ -0,0 +1,88 @@
+import os
+import json
+import asyncio
+import select
+import threading
+from collections import defaultdict
+import psycopg2
+from sqlalchemy import text
+from database import get_engine, SQLALCHEMY_DATABASE_URL, connect_args
+
+# --- CHAT EVENT BUS ---
+# In-process pub/sub feeding the admin SSE stream. With CHAT_EVENTS_PG_NOTIFY=1 every publish goes through
+# Postgres NOTIFY instead, and each worker's listener thread fans it out locally, so all workers see all events.
+PG_CHANNEL = "chat_events"
+PG_BRIDGE_ENABLED = os.getenv("CHAT_EVENTS_PG_NOTIFY", "0") == "1"
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class ChatEventBus:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, clinic_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[clinic_id].add((queue, asyncio.get_running_loop()))
+        return queue
+
+    def unsubscribe(self, clinic_id: str, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers[clinic_id] = {(q, l) for q, l in self._subscribers[clinic_id] if q is not queue}
+            if not self._subscribers[clinic_id]: del self._subscribers[clinic_id]
+
+    def publish(self, clinic_id, event: dict):
+        """For sync route handlers (thread pool) and worker threads; async code uses publish_async."""
+        clinic_id = str(clinic_id)
+        if PG_BRIDGE_ENABLED:
+            try:
+                payload = json.dumps({"clinic_id": clinic_id, "event": event}, default=str)
+                with get_engine().begin() as conn:
+                    conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": PG_CHANNEL, "payload": payload})
+                return
+            except Exception as e:
+                print(f"Chat event NOTIFY failed, delivering locally only: {e}")
+        self._deliver(clinic_id, event)
+
+    async def publish_async(self, clinic_id, event: dict):
+        """For async routes: the NOTIFY round trip runs in a worker thread instead of blocking the event loop."""
+        if PG_BRIDGE_ENABLED: await asyncio.to_thread(self.publish, clinic_id, event)
+        else: self._deliver(str(clinic_id), event)
+
+    def _deliver(self, clinic_id: str, event: dict):
+        with self._lock:
+            targets = list(self._subscribers.get(clinic_id, ()))
+        for queue, loop in targets:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, event: dict):
+        # A stalled tab must not grow memory without bound; it resyncs from the snapshot on reconnect
+        if queue.full(): queue.get_nowait()
+        queue.put_nowait(event)
+
+    def start_pg_bridge(self):
+        if not PG_BRIDGE_ENABLED or self._listener: return
+        self._listener = threading.Thread(target=self._listen_forever, name="chat-events-listener", daemon=True)
+        self._listener.start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                conn = psycopg2.connect(SQLALCHEMY_DATABASE_URL, **connect_args)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {PG_CHANNEL};")
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []): continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        data = json.loads(note.payload)
+                        self._deliver(data["clinic_id"], data["event"])
+            except Exception as e:
+                print(f"Chat event listener lost connection, retrying: {e}")
+                threading.Event().wait(5)
+
+chat_bus = ChatEventBus()
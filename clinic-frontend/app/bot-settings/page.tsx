@@ -23,18 +23,21 @@ export default function BotRepliesPage() {
   const [newChatPhone, setNewChatPhone] = useState("");
   const [newChatMessage, setNewChatMessage] = useState("");
 
+  useEffect(() => {
+    const grouped = history.reduce((acc: any, curr: any) => {
+        const key = curr.phone || "System";
+        if (!acc[key]) acc[key] = [];
+        acc[key].push(curr);
+        return acc;
+    }, {});
+    setGroupedChats(grouped);
+  }, [history]);
+
   const fetchHistory = () => {
     fetch(`http://127.0.0.1:8000/admin/chat-history/${CLINIC_ID}`)
       .then(res => res.json())
       .then(data => {
         setHistory(data);
-        const grouped = data.reduce((acc: any, curr: any) => {
-            const key = curr.phone || "System";
-            if (!acc[key]) acc[key] = [];
-            acc[key].push(curr);
-            return acc;
-        }, {});
-        setGroupedChats(grouped);
         setIsLoading(false);
       })
       .catch(() => setIsLoading(false));
@@ -42,8 +45,29 @@ export default function BotRepliesPage() {
 
   useEffect(() => {
     fetchHistory();
-    const interval = setInterval(fetchHistory, 10000); 
-    return () => clearInterval(interval);
+    // New and replied messages are pushed by the server instead of re-downloading the history every 10s
+    const source = new EventSource(`http://127.0.0.1:8000/admin/chat-events/${CLINIC_ID}`);
+    source.onmessage = (e) => {
+      try {
+        const data = JSON.parse(e.data);
+        if (data.type === 'message') {
+          setHistory(prev => prev.some(m => m.id === data.message.id)
+            ? prev.map(m => m.id === data.message.id ? data.message : m)
+            : [...prev, data.message]);
+        } else if (data.type === 'thread_replied') {
+          setHistory(prev => prev.map(m => m.phone === data.phone && m.status === 'unread' ? { ...m, status: 'replied' } : m));
+        }
+      } catch (error) {}
+    };
+    // EventSource reconnects on its own; anything published while it was down is only in the database, so every
+    // reconnect resyncs (a full fetch, since replied statuses can change on messages we already have)
+    let connectedBefore = false;
+    source.onopen = () => {
+      if (connectedBefore) fetchHistory();
+      connectedBefore = true;
+    };
+    source.onerror = () => { if (source.readyState === EventSource.CLOSED) fetchHistory(); };
+    return () => source.close();
   }, []);
 
   const handleSendToThread = async () => {
@@ -47,23 +47,19 @@ export default function RootLayout({ children }: { children: React.ReactNode })
             }
           };
 
-          const fetchPendingChats = async () => {
+          initializeData();
+
+          // Server pushes a count snapshot on (re)connect, then +/- deltas as chats arrive or get replied to
+          const source = new EventSource(`http://127.0.0.1:8000/admin/chat-events/${activeClinicId}`);
+          source.onmessage = (e) => {
             try {
-              const res = await fetch(`http://127.0.0.1:8000/admin/chat-pending-count/${activeClinicId}`);
-              if (res.ok) {
-                const data = await res.json();
-                if (data && data.count !== undefined) {
-                  setPendingChatCount(data.count);
-                }
-              }
+              const data = JSON.parse(e.data);
+              if (data.type !== 'pending_count') return;
+              if (data.count !== undefined) setPendingChatCount(data.count);
+              else if (data.delta !== undefined) setPendingChatCount(prev => Math.max(0, prev + data.delta));
             } catch (error) {}
           };
-
-          initializeData();
-          fetchPendingChats();
-          
-          const interval = setInterval(fetchPendingChats, 10000); 
-          return () => clearInterval(interval);
+          return () => source.close();
       } else {
           setClinicName("AICAS Clinic System");
       }
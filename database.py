@@ -1,13 +1,19 @@
 import os
+import asyncio
+import threading
+from time import monotonic
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from db_metrics import pool_metrics, InstrumentedQueuePool, InstrumentedAsyncQueuePool
 
 load_dotenv()
 
 # Supabase provides a single standard connection string via DATABASE_URL
 DATABASE_URL = os.getenv("DATABASE_URL")
+SQLALCHEMY_DATABASE_URL = None
 
 if not DATABASE_URL:
     DB_USER = os.getenv("DB_USER")
@@ -15,41 +21,215 @@ if not DATABASE_URL:
     DB_HOST = os.getenv("DB_HOST")
     DB_PORT = os.getenv("DB_PORT")
     DB_NAME = os.getenv("DB_NAME")
-    
+
     if DB_USER and DB_PASSWORD and DB_HOST:
         SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    else:
-        print("CRITICAL ERROR: DATABASE_URL is not set in your .env file.")
-        print("Please create a .env file and add your Supabase connection string.")
-        sys.exit(1) # Stop the server gracefully with a clear error message
 else:
     # SQLAlchemy requires 'postgresql://', some PaaS URLs use 'postgres://'
     if DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
     SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
+# Optional streaming replica for read-only routes (see get_read_db); unset means everything uses the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "5"))
+
+# Pool sizing per engine (the sync and async engines each get their own pool of this size).
+# Pre-ping costs a round trip per checkout; with it off, pool_recycle alone retires stale connections.
+pool_settings = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+}
+
 # Supabase requires SSL for remote connections
 connect_args = {}
-if "supabase" in SQLALCHEMY_DATABASE_URL.lower():
+if SQLALCHEMY_DATABASE_URL and "supabase" in SQLALCHEMY_DATABASE_URL.lower():
     connect_args = {"sslmode": "require"}
 
-try:
+# Startup probe: retried with exponential backoff; 0 attempts means keep trying until it works
+DB_STARTUP_MAX_ATTEMPTS = int(os.getenv("DB_STARTUP_MAX_ATTEMPTS", "0"))
+DB_STARTUP_MAX_DELAY = float(os.getenv("DB_STARTUP_MAX_DELAY", "30"))
+
+# --- LAZY ENGINES ---
+# Nothing here touches the network at import time. Engines are built on first use (SQLAlchemy itself only
+# connects on the first checkout), and wait_for_database() is the explicit connectivity check run at startup.
+_engines = {}
+_engines_lock = threading.Lock()
+
+def require_database_url() -> str:
+    if not SQLALCHEMY_DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set in your .env file. Please add your Supabase connection string.")
+    return SQLALCHEMY_DATABASE_URL
+
+def build_engine(url: str, name: str):
     engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        pool_pre_ping=True, # Verifies connection before using it
-        pool_size=5, 
-        max_overflow=10,
-        connect_args=connect_args
+        url,
+        poolclass=InstrumentedQueuePool,
+        connect_args=connect_args,
+        **pool_settings
     )
-    # Test the connection immediately on startup
-    with engine.connect() as conn:
-        pass
-except Exception as e:
-    print(f"CRITICAL ERROR: Could not connect to the database. Check your DATABASE_URL.")
-    print(f"Details: {e}")
-    sys.exit(1)
+    pool_metrics.instrument(name, engine.pool)
+    return engine
+
+def build_async_engine(url: str, name: str):
+    """asyncpg takes `ssl` instead of libpq's `sslmode`."""
+    async_url = make_url(url).set(drivername="postgresql+asyncpg")
+    async_connect_args = {}
+    sslmode = async_url.query.get("sslmode") or connect_args.get("sslmode")
+    if sslmode:
+        async_connect_args["ssl"] = sslmode
+        async_url = async_url.difference_update_query(["sslmode"])
+    # Supabase's transaction-mode pooler cannot keep server-side prepared statements between transactions
+    if "pooler.supabase.com" in url.lower():
+        async_connect_args["statement_cache_size"] = 0
+
+    engine = create_async_engine(
+        async_url,
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args=async_connect_args,
+        **pool_settings
+    )
+    pool_metrics.instrument(name, engine.sync_engine.pool)
+    return engine
+
+def _engine(key: str, build, url_getter, name: str):
+    with _engines_lock:
+        if key not in _engines: _engines[key] = build(url_getter(), name)
+        return _engines[key]
+
+def get_engine():
+    return _engine("sync", build_engine, require_database_url, "primary")
+
+def get_async_engine():
+    """Async engine (asyncpg) for FastAPI routes that have moved off the thread pool; Celery and the
+    remaining sync routes keep using get_engine()."""
+    return _engine("async", build_async_engine, require_database_url, "async")
+
+def get_replica_engine():
+    return _engine("replica", build_engine, lambda: DATABASE_REPLICA_URL, "replica")
+
+def get_async_replica_engine():
+    return _engine("replica_async", build_async_engine, lambda: DATABASE_REPLICA_URL, "replica_async")
+
+def __getattr__(name):
+    # `from database import engine` keeps working; the engine is built when first asked for
+    if name == "engine": return get_engine()
+    if name == "async_engine": return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class LazySession(Session):
+    engine_factory = staticmethod(get_engine)
+
+    def __init__(self, **kw):
+        kw.setdefault("bind", self.engine_factory())
+        super().__init__(**kw)
+
+class LazyAsyncSession(AsyncSession):
+    engine_factory = staticmethod(get_async_engine)
+
+    def __init__(self, **kw):
+        kw.setdefault("bind", self.engine_factory())
+        super().__init__(**kw)
+
+class ReplicaSession(LazySession):
+    engine_factory = staticmethod(get_replica_engine)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class ReplicaAsyncSession(LazyAsyncSession):
+    engine_factory = staticmethod(get_async_replica_engine)
+
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False)
+AsyncSessionLocal = sessionmaker(class_=LazyAsyncSession, autoflush=False, expire_on_commit=False)
+ReplicaSessionLocal = sessionmaker(class_=ReplicaSession, autocommit=False, autoflush=False)
+AsyncReplicaSessionLocal = sessionmaker(class_=ReplicaAsyncSession, autoflush=False, expire_on_commit=False)
+
+# --- READ REPLICA ROUTING ---
+# Replay lag in seconds; 0 when the replica has applied everything it received (an idle primary is not "lag").
+# NULL unless the WAL receiver is streaming: a disconnected replica also has receive = replay, but it has stopped
+# receiving and would serve ever older data. Reading pg_stat_wal_receiver.status needs pg_read_all_stats on the
+# replica role; without it the status reads NULL and every read stays on the primary.
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class ReplicaRouter:
+    """Decides per request whether a read-only route may use the replica. Lag is re-measured at most every
+    REPLICA_LAG_CHECK_SECONDS by whichever request gets there first; the rest use the last reading."""
+    def __init__(self):
+        self.lag = None
+        self.error = None
+        self.checked_at = float("-inf")
+        self.replica_reads = 0
+        self.fallbacks = 0
+        self._checking = threading.Lock()
+
+    def _check_due(self) -> bool:
+        return monotonic() - self.checked_at >= REPLICA_LAG_CHECK_SECONDS and self._checking.acquire(blocking=False)
+
+    def _record(self, lag=None, error=None):
+        self.lag = float(lag) if lag is not None else None
+        if lag is None and error is None: error = "WAL receiver is not streaming"
+        self.error = str(error) if error else None
+        self.checked_at = monotonic()
+
+    def _decide(self) -> bool:
+        use = self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+        if use: self.replica_reads += 1
+        else: self.fallbacks += 1
+        return use
+
+    def use_replica(self) -> bool:
+        if not DATABASE_REPLICA_URL: return False
+        if self._check_due():
+            try:
+                with get_replica_engine().connect() as conn:
+                    self._record(conn.execute(REPLICA_LAG_SQL).scalar())
+            except Exception as e:
+                self._record(error=e)
+            finally:
+                self._checking.release()
+        return self._decide()
+
+    async def use_replica_async(self) -> bool:
+        if not DATABASE_REPLICA_URL: return False
+        if self._check_due():
+            try:
+                async with get_async_replica_engine().connect() as conn:
+                    self._record((await conn.execute(REPLICA_LAG_SQL)).scalar())
+            except Exception as e:
+                self._record(error=e)
+            finally:
+                self._checking.release()
+        return self._decide()
+
+    def snapshot(self) -> dict:
+        return {"configured": bool(DATABASE_REPLICA_URL), "lag_seconds": self.lag, "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+                "last_error": self.error, "replica_reads": self.replica_reads, "primary_fallbacks": self.fallbacks}
+
+replica_router = ReplicaRouter()
+
+async def wait_for_database():
+    """Blocks until SELECT 1 succeeds, backing off 0.5s, 1s, 2s ... up to DB_STARTUP_MAX_DELAY between attempts."""
+    require_database_url()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            if DB_STARTUP_MAX_ATTEMPTS and attempt >= DB_STARTUP_MAX_ATTEMPTS: raise
+            delay = min(0.5 * 2 ** (attempt - 1), DB_STARTUP_MAX_DELAY)
+            print(f"Database not reachable (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
 
 # Use this single Base for all models
 Base = declarative_base()
@@ -59,4 +239,22 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependencies for read-only routes that tolerate REPLICA_MAX_LAG_SECONDS of staleness. Routes that write, or
+# read back what the same client just wrote, must keep using get_db / get_async_db.
+def get_read_db():
+    db = ReplicaSessionLocal() if replica_router.use_replica() else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    factory = AsyncReplicaSessionLocal if await replica_router.use_replica_async() else AsyncSessionLocal
+    async with factory() as db:
+        yield db
@@ -0,0 +1,124 @@
+import threading
+from collections import deque, defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.routing import Match
+
+# --- CONNECTION POOL METRICS ---
+# Every checkout is attributed to the FastAPI route that made it (set per request by middleware in main.py;
+# Celery and startup work shows up as "-"). Wait is time spent in the pool getting a connection, hold is
+# checkout -> checkin. Pre-ping failures are invalidations that happen between getting and handing out a connection.
+current_route: ContextVar[str] = ContextVar("current_route", default="-")
+SAMPLES_PER_ROUTE = 256
+
+def percentile(samples, q: float) -> float:
+    if not samples: return 0.0
+    ordered = sorted(samples)
+    return ordered[int(q * (len(ordered) - 1))]
+
+class RouteStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.pre_ping_failures = 0
+        self.invalidations = 0
+        self.wait = deque(maxlen=SAMPLES_PER_ROUTE)
+        self.hold = deque(maxlen=SAMPLES_PER_ROUTE)
+
+    def snapshot(self) -> dict:
+        return {
+            "checkouts": self.checkouts, "overflow_checkouts": self.overflow_checkouts,
+            "pre_ping_failures": self.pre_ping_failures, "invalidations": self.invalidations,
+            "wait_ms_p50": round(percentile(self.wait, 0.5) * 1000, 2), "wait_ms_p95": round(percentile(self.wait, 0.95) * 1000, 2),
+            "wait_ms_max": round(max(self.wait, default=0.0) * 1000, 2),
+            "hold_ms_p50": round(percentile(self.hold, 0.5) * 1000, 2), "hold_ms_p95": round(percentile(self.hold, 0.95) * 1000, 2),
+            "hold_ms_max": round(max(self.hold, default=0.0) * 1000, 2),
+        }
+
+class PoolMetrics:
+    def __init__(self):
+        self._pools = {}
+        self._routes = defaultdict(lambda: defaultdict(RouteStats))
+        self._lock = threading.Lock()
+
+    def instrument(self, name: str, pool):
+        self._pools[name] = pool
+        pool.metrics_name = name
+        routes = self._routes[name]
+
+        def on_checkout(dbapi_conn, record, proxy):
+            route = current_route.get()
+            record.info.pop("checkout_pending", None)
+            record.info["checkout_at"] = perf_counter()
+            record.info["route"] = route
+            with self._lock:
+                stats = routes[route]
+                stats.checkouts += 1
+                if pool.checkedout() > pool.size(): stats.overflow_checkouts += 1
+
+        def on_checkin(dbapi_conn, record):
+            started = record.info.pop("checkout_at", None)
+            route = record.info.pop("route", None)
+            if started is None: return
+            with self._lock:
+                routes[route].hold.append(perf_counter() - started)
+
+        def on_invalidate(dbapi_conn, record, exception):
+            with self._lock:
+                stats = routes[current_route.get()]
+                if record.info.pop("checkout_pending", False): stats.pre_ping_failures += 1
+                else: stats.invalidations += 1
+
+        event.listen(pool, "checkout", on_checkout)
+        event.listen(pool, "checkin", on_checkin)
+        event.listen(pool, "invalidate", on_invalidate)
+
+    def record_wait(self, pool, record, seconds: float):
+        # A pool rebuilt by engine.dispose() is not registered here
+        name = getattr(pool, "metrics_name", None)
+        if name is None: return
+        with self._lock:
+            self._routes[name][current_route.get()].wait.append(seconds)
+        # Cleared by the checkout event; an invalidation before that is a failed pre-ping
+        record.info["checkout_pending"] = True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: {
+                "pool": {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": max(0, pool.overflow()), "status": pool.status()},
+                "routes": {route: stats.snapshot() for route, stats in sorted(self._routes[name].items())}
+            } for name, pool in self._pools.items()}
+
+pool_metrics = PoolMetrics()
+
+class _TimedCheckout:
+    def _do_get(self):
+        started = perf_counter()
+        record = super()._do_get()
+        pool_metrics.record_wait(self, record, perf_counter() - started)
+        return record
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+class RouteTagMiddleware:
+    """Pure ASGI (so streaming responses are untouched): tags the request context with its route template."""
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = next((r.path for r in self.router.routes if r.matches(scope)[0] == Match.FULL), "unmatched")
+        token = current_route.set(f"{scope['method']} {route}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_route.reset(token)
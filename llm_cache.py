@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# --- LLM RESPONSE CACHE ---
+# In-memory LRU with TTL, optionally backed by a local SQLite file so warm entries survive restarts.
+# Values are the parsed LLM JSON, never anything resolved against "now".
+
+def normalize_text(text: str) -> str:
+    """Case/whitespace/punctuation-insensitive key: "Tomorrow,  10am!" == "tomorrow 10am"."""
+    text = re.sub(r"[^\w:/\-.]+", " ", str(text).lower())
+    return re.sub(r"\s+", " ", text).strip(" .")
+
+class LLMResponseCache:
+    """get/put are for sync code and worker threads. Coroutines use aget/aput, which answer from memory on the
+    loop and only send SQLite reads and writes to a thread."""
+    PRUNE_EVERY_PUTS = 500
+
+    def __init__(self, namespace: str, maxsize: int = 5000, ttl: float = 86400.0, sqlite_path: Optional[str] = None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (namespace TEXT, key TEXT, value TEXT, stored_at REAL, PRIMARY KEY (namespace, key))")
+            self._db.commit()
+            self._prune_disk()
+
+    # --- memory ---
+    def _memory_get(self, key: str, now: float):
+        """Returns (found, value). found=None means "not in memory, ask the disk"."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None: return (None, None) if self._db is not None else self._miss()
+            if entry[0] + self.ttl < now:
+                del self._data[key]
+                return self._miss()
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def _miss(self):
+        self.misses += 1
+        return False, None
+
+    def _memory_put(self, key: str, stored_at: float, value: dict):
+        with self._lock:
+            self._data[key] = (stored_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # --- disk (blocking; called directly by get/put, from a thread by aget/aput) ---
+    def _disk_get(self, key: str, now: float) -> Optional[dict]:
+        with self._db_lock:
+            row = self._db.execute("SELECT value, stored_at FROM llm_cache WHERE namespace = ? AND key = ? AND stored_at >= ?", (self.namespace, key, now - self.ttl)).fetchone()
+        if not row:
+            with self._lock: self._miss()
+            return None
+        value = json.loads(row[0])
+        self._memory_put(key, row[1], value)
+        with self._lock: self.hits += 1
+        return value
+
+    def _disk_put(self, key: str, stored_at: float, value: dict):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)", (self.namespace, key, json.dumps(value), stored_at))
+            self._db.commit()
+            self._puts += 1
+            prune = self._puts % self.PRUNE_EVERY_PUTS == 0
+        if prune: self._prune_disk()
+
+    def _prune_disk(self):
+        """Expired rows are deleted at startup and every PRUNE_EVERY_PUTS writes; the memory TTL alone never shrinks the file."""
+        with self._db_lock:
+            self._db.execute("DELETE FROM llm_cache WHERE namespace = ? AND stored_at < ?", (self.namespace, time.time() - self.ttl))
+            self._db.commit()
+
+    def _disk_delete(self, key: str):
+        with self._db_lock:
+            self._db.execute("DELETE FROM llm_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._db.commit()
+
+    # --- public ---
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        found, value = self._memory_get(key, now)
+        if found is None: return self._disk_get(key, now)
+        return value
+
+    async def aget(self, key: str) -> Optional[dict]:
+        now = time.time()
+        found, value = self._memory_get(key, now)
+        if found is None: return await asyncio.to_thread(self._disk_get, key, now)
+        return value
+
+    def put(self, key: str, value: dict):
+        now = time.time()
+        self._memory_put(key, now, value)
+        if self._db is not None: self._disk_put(key, now, value)
+
+    async def aput(self, key: str, value: dict):
+        now = time.time()
+        self._memory_put(key, now, value)
+        if self._db is not None: await asyncio.to_thread(self._disk_put, key, now, value)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+        if self._db is not None: self._disk_delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+def cache_from_env(namespace: str, default_ttl: float) -> LLMResponseCache:
+    return LLMResponseCache(
+        namespace,
+        maxsize=int(os.getenv("LLM_CACHE_MAXSIZE", "5000")),
+        ttl=float(os.getenv(f"LLM_CACHE_TTL_{namespace.upper()}", str(default_ttl))),
+        sqlite_path=os.getenv("LLM_CACHE_SQLITE_PATH") or None,
+    )
@@ -1,20 +1,33 @@
 import os
-import httpx
+import json
+import asyncio
 import secrets
 import string
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import tuple_, func, case, select, update, and_, or_
 from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_async_db, get_read_db, get_engine, wait_for_database, SessionLocal, AsyncSessionLocal, pool_settings, replica_router
+from db_metrics import pool_metrics, RouteTagMiddleware
 import models
+import calendar_events
+import vaccine_knowledge
+import outbox
+from chat_events import chat_bus
+from auth_cache import principal_cache
+from passwords import verify_password_async, get_password_hash, get_password_hash_async, needs_rehash, code_digest, verify_code_digest, hashing_pool, HashingBusy
 from pydantic import BaseModel
 from typing import Dict, Any, Optional, List
-from agent import extract_appointment_details, generate_vaccine_schedule_ai
+from agent import extract_appointment_details, generate_vaccine_schedule_ai, llm_clients, llm_backends, extraction_cache, fast_path_stats, single_flight_stats
+from availability import day_code, minute_of, slots_for_day, day_summaries, slot_cache, index_cache, pref_key, FreeSlotIndex
+from ttl_cache import TTLCache
 from datetime import datetime, timedelta
-import random
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import re
+import base64
 import jwt
-import bcrypt
 import uuid
 
 # --- JWT Config ---
@@ -22,20 +35,18 @@ SECRET_KEY = os.getenv("JWT_SECRET", "super-secret-aicas-key-change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440 # 24 Hours
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    try:
-        truncated_plain = plain_password.encode('utf-8')[:72]
-        hash_bytes = hashed_password.encode('utf-8')
-        return bcrypt.checkpw(truncated_plain, hash_bytes)
-    except Exception as e:
-        print(f"Bcrypt verify error: {e}")
-        return False
-
-def get_password_hash(password: str) -> str:
-    truncated_password = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt(rounds=12)
-    hashed = bcrypt.hashpw(truncated_password, salt)
-    return hashed.decode('utf-8')
+# --- App Config ---
+AVAILABLE_DATES_HORIZON_DAYS = int(os.getenv("AVAILABLE_DATES_HORIZON_DAYS", "30"))
+CALENDAR_PAGE_MAX = 1000
+CHAT_EVENTS_HEARTBEAT_SECONDS = 15
+CHAT_PAGE_MAX = 500
+CLINIC_PAGE_MAX = 500
+# Developer console clinic list; 0 turns the snapshot off. Clinic and admin writes clear it in the worker that
+# handled the write; other uvicorn workers may serve their copy for up to the TTL.
+CLINIC_LIST_CACHE_TTL_SECONDS = float(os.getenv("CLINIC_LIST_CACHE_TTL_SECONDS", "30"))
+clinic_list_cache = TTLCache(maxsize=64, ttl=CLINIC_LIST_CACHE_TTL_SECONDS)
+# Set to 0 when a Celery worker runs the outbox dispatcher and API processes should only enqueue
+OUTBOX_DISPATCH_INLINE = os.getenv("OUTBOX_DISPATCH_INLINE", "1") == "1"
 
 def generate_temp_password():
     alphabet = string.ascii_letters + string.digits
@@ -52,6 +63,23 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def resolve_principal(db: Session, payload: dict) -> dict:
+    ic = payload.get("sub")
+    clinic_id = payload.get("clinic_id")
+    user = db.query(models.User).filter(models.User.ic_passport_number == ic).first()
+    if user is None: raise HTTPException(status_code=401, detail="User not found")
+
+    staff = db.query(models.ClinicStaff).filter_by(ic_passport_number=ic, clinic_id=clinic_id).first()
+    if not staff and payload.get("role") != 'developer':
+        raise HTTPException(status_code=403, detail="Account is not mapped to this clinic")
+
+    principal = {"ic_passport_number": user.ic_passport_number, "name": user.name, "email": user.email}
+    if staff:
+        principal.update(role=staff.role, clinic_id=staff.clinic_id, permissions=staff.permissions, status=staff.status)
+    else:
+        principal.update(role='developer', clinic_id=clinic_id, permissions='ALL', status='active')
+    return principal
+
 def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
@@ -62,36 +90,100 @@ def get_current_user(authorization: str = Header(None), db: Session = Depends(ge
         clinic_id = payload.get("clinic_id")
         
         if ic is None: raise HTTPException(status_code=401, detail="Invalid token payload")
-        
-        user = db.query(models.User).filter(models.User.ic_passport_number == ic).first()
-        if user is None: raise HTTPException(status_code=401, detail="User not found")
-        
-        staff = db.query(models.ClinicStaff).filter_by(ic_passport_number=ic, clinic_id=clinic_id).first()
-        if not staff and payload.get("role") != 'developer':
-            raise HTTPException(status_code=403, detail="Account is not mapped to this clinic")
-            
-        if staff:
-            user.role = staff.role
-            user.clinic_id = staff.clinic_id
-            user.permissions = staff.permissions
-            user.status = staff.status
-        else:
-            user.role = 'developer'
-            user.clinic_id = clinic_id
-            user.status = 'active'
-            user.permissions = 'ALL'
 
-        if user.status != 'active': raise HTTPException(status_code=403, detail="Account is not active")
+        # Only active principals are cached, so a rejected account is re-checked on every request
+        principal = principal_cache.get(ic, clinic_id)
+        if principal is None:
+            principal = resolve_principal(db, payload)
+            if principal["status"] != 'active': raise HTTPException(status_code=403, detail="Account is not active")
+            principal_cache.put(ic, clinic_id, principal)
+
+        # A detached User carrying the staff fields, as routes expect; it is never added to a session
+        user = models.User(ic_passport_number=principal["ic_passport_number"], name=principal["name"], email=principal["email"])
+        user.role = principal["role"]
+        user.clinic_id = principal["clinic_id"]
+        user.permissions = principal["permissions"]
+        user.status = principal["status"]
         return user
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Token expired or invalid")
 
 app = FastAPI(title="Clinic Smart Assistant Backend")
 
+app.add_middleware(RouteTagMiddleware, router=app.router)
 app.add_middleware(
-    CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+    CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor"],
 )
 
+# Flipped once the database answered and the read models exist; /ready reports it to the load balancer
+startup_state = {"ready": False, "error": None}
+
+def create_read_models():
+    models.ensure_schema(get_engine())
+    with SessionLocal() as db:
+        vaccine_knowledge.seed_from_catalog(db)
+
+@app.on_event("startup")
+async def prepare_database():
+    """Connects (with backoff) and creates the read models in the background, so a cold start serves /ready at once."""
+    async def prepare():
+        try:
+            await wait_for_database()
+            await asyncio.to_thread(create_read_models)
+            startup_state.update(ready=True, error=None)
+        except Exception as e:
+            startup_state["error"] = str(e)
+            print(f"CRITICAL ERROR: Database startup failed. Check your DATABASE_URL.\nDetails: {e}")
+    app.state.database_startup = asyncio.create_task(prepare())
+
+@app.get("/ready")
+def readiness(response: Response):
+    if not startup_state["ready"]:
+        response.status_code = 503
+        return {"status": "starting", "error": startup_state["error"]}
+    return {"status": "ready"}
+
+@app.on_event("startup")
+def start_chat_event_bridge():
+    chat_bus.start_pg_bridge()
+
+@app.on_event("startup")
+async def open_llm_clients():
+    await llm_clients.start()
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await llm_clients.close()
+
+@app.on_event("shutdown")
+def close_hashing_pool():
+    hashing_pool.shutdown()
+
+@app.exception_handler(HashingBusy)
+async def hashing_busy_handler(request: Request, exc: HashingBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many sign-in attempts in progress, please retry."}, headers={"Retry-After": "2"})
+
+@app.get("/metrics/llm-pool")
+def llm_pool_metrics():
+    return {**llm_clients.metrics(), "health": {name: b.snapshot() for name, b in llm_backends.items()}}
+
+@app.get("/metrics/llm-cache")
+def llm_cache_metrics():
+    return {
+        "extraction": extraction_cache.stats(),
+        "vaccine_knowledge": vaccine_knowledge.stats(),
+        "fast_path": dict(fast_path_stats),
+        "single_flight": dict(single_flight_stats)
+    }
+
+@app.get("/metrics/db")
+def db_pool_metrics():
+    return {"settings": pool_settings, "pools": pool_metrics.snapshot(), "replica": replica_router.snapshot()}
+
+@app.get("/metrics/auth-cache")
+def auth_cache_metrics():
+    return principal_cache.stats()
+
 # --- Pydantic Models ---
 class CheckEmailReq(BaseModel):
     email: str
@@ -124,6 +216,7 @@ class ClinicRegistrationReq(BaseModel):
     registration_number: Optional[str] = None
     address: Optional[str] = None
     contact_number: Optional[str] = None
+    timezone: Optional[str] = None
     admin_ic: str
     admin_name: str
     admin_email: str
@@ -277,6 +370,31 @@ def logging_agent(db: Session, clinic_id: str, action: str, reasoning: str):
     db.add(log)
     db.commit()
 
+def invalidate_availability(clinic_id, *days):
+    """Drop cached availability for the clinic-days a write touched (all days if none given)."""
+    if not clinic_id: return
+    days = [d.date() if isinstance(d, datetime) else d for d in days if d]
+    day_summaries.invalidate(str(clinic_id), *days)
+    slot_cache.invalidate(str(clinic_id), *days)
+    # Indexes span the whole horizon, so any touched day drops the clinic's index
+    index_cache.invalidate(str(clinic_id))
+
+def kick_outbox(background_tasks: BackgroundTasks):
+    """Send what was just enqueued right after the response goes out; the Celery sweep handles retries."""
+    if OUTBOX_DISPATCH_INLINE: background_tasks.add_task(outbox.dispatch_batch, outbox.OUTBOX_INLINE_BATCH_SIZE)
+
+def chat_message_dict(m: models.ChatMessage, phone: Optional[str] = None) -> dict:
+    return {
+        "id": m.id, 
+        "telegram_id": m.telegram_id, 
+        "phone": phone or m.phone or (f"Unknown ({m.telegram_id})" if m.telegram_id else None),
+        "channel": m.channel or 'telegram',
+        "message": m.message, 
+        "reply": m.reply, 
+        "created_at": m.created_at, 
+        "status": m.status
+    }
+
 def calculate_future_date(start_date: datetime, interval_str: str) -> Optional[datetime]:
     if not interval_str or interval_str.strip().lower() in ["", "initial", "none", "blank"]:
         return None
@@ -311,6 +429,14 @@ def format_doctor_name(name: str) -> str:
         return f"DR. {n[3:].strip()}"
     return n
 
+def valid_timezone(tz: Optional[str]) -> str:
+    if not tz: return models.DEFAULT_TIMEZONE
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+    return tz
+
 def safe_update_user_ic(db: Session, old_ic: str, new_ic: str):
     dependents = db.query(models.ClinicStaff).filter(models.ClinicStaff.assigned_by == old_ic).all()
     for dep in dependents:
@@ -355,6 +481,7 @@ def safe_update_user_ic(db: Session, old_ic: str, new_ic: str):
     for dep in dependents:
         dep.assigned_by = new_ic
     db.flush()
+    principal_cache.invalidate(sub=old_ic)
 
 def check_and_update_user(db: Session, ic: str, name: str, email: str, force_email_update: bool):
     user = db.query(models.User).filter_by(ic_passport_number=ic).first()
@@ -413,7 +540,7 @@ def check_email_for_clinics(req: CheckEmailReq, db: Session = Depends(get_db)):
 
 # --- SECURE ENDPOINTS ---
 @app.post("/admin/login")
-def admin_login(data: LoginReq, db: Session = Depends(get_db)):
+async def admin_login(data: LoginReq, db: AsyncSession = Depends(get_async_db)):
     if data.email == 'developer@aicas.com' and data.password == 'aicasdev2026' and data.clinic_id == 'dev':
         return {
             "status": "success", 
@@ -427,19 +554,24 @@ def admin_login(data: LoginReq, db: Session = Depends(get_db)):
             }
         }
 
-    user = db.query(models.User).filter(models.User.email == data.email).first()
+    user = (await db.execute(select(models.User).where(models.User.email == data.email))).scalars().first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
         
-    staff = db.query(models.ClinicStaff).filter(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.clinic_id == data.clinic_id, models.ClinicStaff.status == 'active').first()
+    staff = (await db.execute(select(models.ClinicStaff).where(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.clinic_id == data.clinic_id, models.ClinicStaff.status == 'active'))).scalars().first()
     
     if not staff:
         raise HTTPException(status_code=403, detail="Account is disabled or not mapped to this clinic")
         
-    if data.password.startswith("tmp_") and (user.password_hash == data.password or verify_password(data.password, user.password_hash)):
+    password_ok = user.password_hash == data.password or await verify_password_async(data.password, user.password_hash)
+    if data.password.startswith("tmp_") and password_ok:
         return {"status": "requires_reset", "email": data.email}
     
-    if user.password_hash == data.password or verify_password(data.password, user.password_hash):
+    if password_ok:
+        # Upgrade legacy plaintext and hashes made at a different cost while we have the password
+        if needs_rehash(user.password_hash):
+            user.password_hash = await get_password_hash_async(data.password)
+            await db.commit()
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": user.ic_passport_number, "role": staff.role, "clinic_id": str(staff.clinic_id)}, 
@@ -460,16 +592,16 @@ def admin_login(data: LoginReq, db: Session = Depends(get_db)):
     raise HTTPException(status_code=401, detail="Invalid email or password")
 
 @app.post("/admin/force-reset")
-def force_password_reset(data: FirstLoginResetReq, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == data.email).first()
+async def force_password_reset(data: FirstLoginResetReq, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.email == data.email))).scalars().first()
     if not user: raise HTTPException(status_code=404, detail="User not found")
     
-    staff = db.query(models.ClinicStaff).filter(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.status == 'active').first()
+    staff = (await db.execute(select(models.ClinicStaff).where(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.status == 'active'))).scalars().first()
     if not staff: raise HTTPException(status_code=403, detail="Account is disabled")
     
-    if user.password_hash == data.temp_password or verify_password(data.temp_password, user.password_hash):
-        user.password_hash = get_password_hash(data.new_password)
-        db.commit()
+    if user.password_hash == data.temp_password or await verify_password_async(data.temp_password, user.password_hash):
+        user.password_hash = await get_password_hash_async(data.new_password)
+        await db.commit()
         
         if data.clinic_id == 'dev':
              return {
@@ -478,7 +610,7 @@ def force_password_reset(data: FirstLoginResetReq, db: Session = Depends(get_db)
                 "user": { "ic": "dev", "name": "AICAS Developer", "role": "developer", "permissions": "ALL", "clinic_id": "dev" }
             }
             
-        staff = db.query(models.ClinicStaff).filter(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.clinic_id == data.clinic_id, models.ClinicStaff.status == 'active').first()
+        staff = (await db.execute(select(models.ClinicStaff).where(models.ClinicStaff.ic_passport_number == user.ic_passport_number, models.ClinicStaff.clinic_id == data.clinic_id, models.ClinicStaff.status == 'active'))).scalars().first()
         if not staff: raise HTTPException(status_code=403, detail="Account is disabled or not mapped to this clinic")
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -500,13 +632,13 @@ def force_password_reset(data: FirstLoginResetReq, db: Session = Depends(get_db)
     raise HTTPException(status_code=401, detail="Invalid temporary password")
 
 @app.post("/admin/forgot-password")
-async def forgot_password(req: ForgotPasswordReq, db: Session = Depends(get_db)):
+def forgot_password(req: ForgotPasswordReq, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.email == req.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="This email is not registered.")
     
-    code = ''.join(random.choices(string.digits, k=6))
-    hashed_code = get_password_hash(code)
+    code = ''.join(secrets.choice(string.digits) for _ in range(6))
+    hashed_code = code_digest(user.ic_passport_number, code)
     
     db.query(models.VerificationCode).filter(
         models.VerificationCode.ic_passport_number == user.ic_passport_number,
@@ -519,117 +651,117 @@ async def forgot_password(req: ForgotPasswordReq, db: Session = Depends(get_db))
         expires_at=datetime.utcnow() + timedelta(minutes=15)
     )
     db.add(v_code)
+    outbox.enqueue(
+        db, "email", req.email,
+        f"Hello {user.name},\n\nYou requested to reset your password. Here is your 6-digit verification code:\n\n{code}\n\nThis code will expire in 15 minutes. If you did not request this, please ignore this email.",
+        subject="AICAS Password Reset Verification Code", sensitive=True
+    )
     db.commit()
-
-    sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
-    sendgrid_from_email = os.getenv("SENDGRID_FROM_EMAIL")
-    
-    if sendgrid_api_key and sendgrid_from_email:
-        try:
-            email_data = {
-                "personalizations": [{
-                    "to": [{"email": req.email}], 
-                    "subject": "AICAS Password Reset Verification Code"
-                }],
-                "from": {"email": sendgrid_from_email, "name": "AICAS System"},
-                "content": [{
-                    "type": "text/plain", 
-                    "value": f"Hello {user.name},\n\nYou requested to reset your password. Here is your 6-digit verification code:\n\n{code}\n\nThis code will expire in 15 minutes. If you did not request this, please ignore this email."
-                }]
-            }
-            
-            async with httpx.AsyncClient() as client:
-                res = await client.post(
-                    "https://api.sendgrid.com/v3/mail/send",
-                    headers={
-                        "Authorization": f"Bearer {sendgrid_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=email_data,
-                    timeout=10.0
-                )
-                if res.status_code not in [200, 202, 204]:
-                    print(f"Failed to send email via SendGrid: {res.text}")
-        except Exception as e:
-            print(f"Failed to send email via SendGrid: {e}")
-    else:
-        print("\n========== MOCK EMAIL VERIFICATION ==========")
-        print(f"To: {req.email}")
-        print(f"Code: {code}")
-        print("=============================================\n")
-        print("WARNING: SENDGRID_API_KEY or SENDGRID_FROM_EMAIL missing in .env. Fallback to terminal print.")
-    
+    kick_outbox(background_tasks)
     return {"status": "success"}
 
 @app.post("/admin/verify-code")
-def verify_code(req: VerifyCodeReq, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == req.email).first()
+async def verify_code(req: VerifyCodeReq, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.email == req.email))).scalars().first()
     if not user:
         raise HTTPException(status_code=400, detail="Invalid request.")
         
-    v_code = db.query(models.VerificationCode).filter(
+    v_code = (await db.execute(select(models.VerificationCode).where(
         models.VerificationCode.ic_passport_number == user.ic_passport_number,
         models.VerificationCode.used == False,
         models.VerificationCode.expires_at > datetime.utcnow()
-    ).order_by(models.VerificationCode.created_at.desc()).first()
+    ).order_by(models.VerificationCode.created_at.desc()))).scalars().first()
     
-    if not v_code or not verify_password(req.code, v_code.code_hash):
+    if not v_code or not await verify_code_digest(user.ic_passport_number, req.code, v_code.code_hash):
         raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
         
     return {"status": "success"}
 
 @app.post("/admin/reset-password")
-def reset_password(req: ResetPasswordReq, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == req.email).first()
+async def reset_password(req: ResetPasswordReq, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.email == req.email))).scalars().first()
     if not user:
         raise HTTPException(status_code=400, detail="Invalid request.")
         
-    v_code = db.query(models.VerificationCode).filter(
+    v_code = (await db.execute(select(models.VerificationCode).where(
         models.VerificationCode.ic_passport_number == user.ic_passport_number,
         models.VerificationCode.used == False,
         models.VerificationCode.expires_at > datetime.utcnow()
-    ).order_by(models.VerificationCode.created_at.desc()).first()
+    ).order_by(models.VerificationCode.created_at.desc()))).scalars().first()
     
-    if not v_code or not verify_password(req.code, v_code.code_hash):
+    if not v_code or not await verify_code_digest(user.ic_passport_number, req.code, v_code.code_hash):
         raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
     
-    user.password_hash = get_password_hash(req.new_password)
+    user.password_hash = await get_password_hash_async(req.new_password)
     v_code.used = True
-    db.commit()
+    await db.commit()
     return {"status": "success"}
 
+def encode_clinic_cursor(clinic: models.Clinic) -> str:
+    return base64.urlsafe_b64encode(f"{clinic.name}|{clinic.id}".encode()).decode()
+
+def decode_clinic_cursor(cursor: str):
+    try:
+        name, clinic_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return name, uuid.UUID(clinic_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def admin_summary(ic, name, email, status) -> Optional[dict]:
+    return {"ic": ic, "name": name, "email": email, "status": status} if ic else None
+
 @app.get("/admin/clinics")
-def get_all_clinics(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_all_clinics(response: Response, q: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != 'developer':
         raise HTTPException(status_code=403, detail="Not authorized")
-    clinics = db.query(models.Clinic).all()
-    res = []
-    for c in clinics:
-        admins = db.query(models.User, models.ClinicStaff).join(
-            models.ClinicStaff, models.User.ic_passport_number == models.ClinicStaff.ic_passport_number
-        ).filter(models.ClinicStaff.clinic_id == c.id).all()
-        
-        primary = next(((u, s) for u, s in admins if s.role == 'primary_admin'), None)
-        temp = next(((u, s) for u, s in admins if s.role == 'temporary_admin'), None)
-        res.append({
-            "id": str(c.id),
-            "name": c.name,
-            "registration_number": c.registration_number,
-            "address": c.address,
-            "contact_number": c.contact_number,
-            "admin": {
-                "ic": primary[0].ic_passport_number,
-                "name": primary[0].name,
-                "email": primary[0].email,
-                "status": primary[1].status
-            } if primary else None,
-            "temp_admin": {
-                "ic": temp[0].ic_passport_number,
-                "name": temp[0].name,
-                "email": temp[0].email,
-                "status": temp[1].status
-            } if temp else None
-        })
+    if limit: limit = max(1, min(limit, CLINIC_PAGE_MAX))
+    # Read from the primary: a lagging replica page would be cached right after a write cleared the snapshot
+    cache_key = ((q or "").strip().lower(), cursor, limit)
+    if CLINIC_LIST_CACHE_TTL_SECONDS > 0:
+        cached = clinic_list_cache.get(cache_key)
+        if cached is not None:
+            if cached["next_cursor"]: response.headers["X-Next-Cursor"] = cached["next_cursor"]
+            return cached["clinics"]
+
+    # One grouped query: each clinic with its primary and temporary admin picked out by conditional aggregation
+    staff, user = models.ClinicStaff, models.User
+    def admin_col(role, col): return func.max(case((staff.role == role, col)))
+    query = db.query(
+        models.Clinic,
+        admin_col('primary_admin', user.ic_passport_number), admin_col('primary_admin', user.name),
+        admin_col('primary_admin', user.email), admin_col('primary_admin', staff.status),
+        admin_col('temporary_admin', user.ic_passport_number), admin_col('temporary_admin', user.name),
+        admin_col('temporary_admin', user.email), admin_col('temporary_admin', staff.status)
+    ).outerjoin(
+        staff, and_(staff.clinic_id == models.Clinic.id, staff.role.in_(['primary_admin', 'temporary_admin']))
+    ).outerjoin(
+        user, user.ic_passport_number == staff.ic_passport_number
+    )
+    if q:
+        # Escape LIKE wildcards so "%" or "_" in the search box match literally
+        term = q.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{term}%"
+        query = query.filter(or_(models.Clinic.name.ilike(pattern, escape="\\"), models.Clinic.registration_number.ilike(pattern, escape="\\")))
+    if cursor:
+        query = query.filter(tuple_(models.Clinic.name, models.Clinic.id) > decode_clinic_cursor(cursor))
+    query = query.group_by(models.Clinic.id).order_by(models.Clinic.name.asc(), models.Clinic.id.asc())
+    rows = query.limit(limit + 1).all() if limit else query.all()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_clinic_cursor(rows[-1][0])
+        response.headers["X-Next-Cursor"] = next_cursor
+    res = [{
+        "id": str(c.id),
+        "name": c.name,
+        "registration_number": c.registration_number,
+        "address": c.address,
+        "contact_number": c.contact_number,
+        "admin": admin_summary(*admin_cols[:4]),
+        "temp_admin": admin_summary(*admin_cols[4:])
+    } for c, *admin_cols in rows]
+    if CLINIC_LIST_CACHE_TTL_SECONDS > 0: clinic_list_cache.put(cache_key, {"clinics": res, "next_cursor": next_cursor})
     return res
 
 @app.post("/admin/register-clinic")
@@ -645,7 +777,8 @@ def register_clinic(data: ClinicRegistrationReq, db: Session = Depends(get_db),
             name=data.clinic_name,
             registration_number=data.registration_number,
             address=data.address,
-            contact_number=data.contact_number
+            contact_number=data.contact_number,
+            timezone=valid_timezone(data.timezone)
         )
         db.add(new_clinic)
         db.flush()
@@ -673,6 +806,7 @@ def register_clinic(data: ClinicRegistrationReq, db: Session = Depends(get_db),
             db.add(t_staff)
 
         db.commit()
+        clinic_list_cache.clear()
         return {
             "status": "success", 
             "clinic_id": str(new_clinic.id), 
@@ -697,6 +831,7 @@ def update_clinic(clinic_id: str, data: ClinicRegistrationReq, db: Session = Dep
         clinic.registration_number = data.registration_number
         clinic.address = data.address
         clinic.contact_number = data.contact_number
+        if data.timezone: clinic.timezone = valid_timezone(data.timezone)
 
         admin_pwd = None
         temp_admin_pwd = None
@@ -768,6 +903,8 @@ def update_clinic(clinic_id: str, data: ClinicRegistrationReq, db: Session = Dep
                 db.add(new_t_staff)
 
         db.commit()
+        principal_cache.invalidate(clinic_id=clinic_id)
+        clinic_list_cache.clear()
         return {
             "status": "success",
             "admin_pwd": admin_pwd,
@@ -781,6 +918,9 @@ def update_clinic(clinic_id: str, data: ClinicRegistrationReq, db: Session = Dep
 def delete_clinic(clinic_id: str, db: Session = Depends(get_db)):
     db.query(models.Clinic).filter(models.Clinic.id == clinic_id).delete()
     db.commit()
+    principal_cache.invalidate(clinic_id=clinic_id)
+    clinic_list_cache.clear()
+    invalidate_availability(clinic_id)
     return {"status": "success"}
     
 @app.get("/admin/users")
@@ -827,6 +967,8 @@ def create_user(data: UserCreateReq, db: Session = Depends(get_db), current_user
     )
     db.add(new_staff)
     db.commit()
+    principal_cache.invalidate(sub=data.ic_passport_number)
+    clinic_list_cache.clear()
     return {"status": "success", "temp_password": temp_pwd, "message": "Password generated successfully." if temp_pwd else "Existing user successfully linked to clinic."}
 
 @app.put("/admin/users/{ic}")
@@ -854,125 +996,67 @@ def update_user(ic: str, data: UserUpdateReq, db: Session = Depends(get_db), cur
             staff.permissions = data.permissions
         
     db.commit()
+    principal_cache.invalidate(sub=ic)
+    clinic_list_cache.clear()
     return {"status": "success", "temp_password": temp_pwd}
     
 @app.put("/admin/profile")
-def update_self_profile(data: UserSelfUpdateReq, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    user = db.query(models.User).filter(models.User.ic_passport_number == current_user.ic_passport_number).first()
+async def update_self_profile(data: UserSelfUpdateReq, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    user = (await db.execute(select(models.User).where(models.User.ic_passport_number == current_user.ic_passport_number))).scalars().first()
     user.name = data.name.upper()
     user.email = data.email
     if data.password:
-        user.password_hash = get_password_hash(data.password)
-    db.commit()
+        user.password_hash = await get_password_hash_async(data.password)
+    await db.commit()
+    principal_cache.invalidate(sub=user.ic_passport_number)
+    clinic_list_cache.clear()
     return {"status": "success", "name": user.name}
 
-@app.get("/admin/appointments/{clinic_id}")
-def admin_get_all_appointments(clinic_id: str, db: Session = Depends(get_db)):
+def parse_calendar_bound(value: str) -> datetime:
+    try: return datetime.fromisoformat(value.replace("Z", ""))
+    except ValueError: raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+def encode_calendar_cursor(event: models.CalendarEvent) -> str:
+    raw = f"{event.scheduled_time.isoformat()}|{event.stage_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_calendar_cursor(cursor: str):
     try:
-        appointments = db.query(models.Appointment).filter(models.Appointment.clinic_id == clinic_id).all()
-        appt_ids = [a.id for a in appointments]
-        if not appt_ids: return []
-        
-        stages = db.query(models.ApptStage).filter(models.ApptStage.appointment_id.in_(appt_ids)).all()
-        appt_dict = {str(a.id): a for a in appointments}
-        
-        patient_ics = list({a.patient_ic for a in appointments if a.patient_ic})
-        patients = db.query(models.Patient).filter(models.Patient.ic_passport_number.in_(patient_ics)).all() if patient_ics else []
-        patient_dict = {str(p.ic_passport_number): p for p in patients}
-        
-        doctor_ics = list({a.doctor_ic for a in appointments if a.doctor_ic})
-        doctors = db.query(models.Doctor).filter(models.Doctor.ic_passport_number.in_(doctor_ics)).all() if doctor_ics else []
-        doctor_dict = {str(d.ic_passport_number): d for d in doctors}
+        t_str, stage_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(t_str), uuid.UUID(stage_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-        appt_vaccines = db.query(models.AppointmentVaccine).filter(models.AppointmentVaccine.appointment_id.in_(appt_ids)).all() if appt_ids else []
-        appt_tests = db.query(models.AppointmentBloodTest).filter(models.AppointmentBloodTest.appointment_id.in_(appt_ids)).all() if appt_ids else []
-        
-        vac_dict = {}
-        for av in appt_vaccines:
-            key = str(av.appointment_id)
-            if key not in vac_dict: vac_dict[key] = []
-            vac_dict[key].append(av)
-            
-        test_dict = {}
-        for at in appt_tests:
-            key = str(at.appointment_id)
-            if key not in test_dict: test_dict[key] = []
-            test_dict[key].append(at)
-            
-        all_vacs = db.query(models.Vaccine).all()
-        v_name_map = {v.id: v.name for v in all_vacs}
-        
-        all_tests = db.query(models.BloodTest).all()
-        t_name_map = {t.id: t.name for t in all_tests}
-
-        result = []
-        for stage in stages:
-            if not stage.scheduled_time: continue
-            appt = appt_dict.get(str(stage.appointment_id))
-            if not appt: continue
-            
-            patient = patient_dict.get(str(appt.patient_ic))
-            doctor = doctor_dict.get(str(appt.doctor_ic)) if appt.doctor_ic else None
-
-            key = str(appt.id)
-            items_list = []
-            dose_val = stage.stage_name
-            total_doses = appt.total_stages
-
-            service = "Consultation"
-            color = "#3B82F6" 
-
-            if key in vac_dict:
-                service = "Vaccine"
-                color = "#A855F7"
-                for av in vac_dict[key]:
-                    v_name = v_name_map.get(av.vaccine_id, "Unknown Vaccine")
-                    items_list.append(v_name)
-                    dose_val = stage.stage_name if stage.stage_name.startswith("Dose") else av.dose_number
-            elif key in test_dict:
-                service = "Blood Test"
-                color = "#EF4444"
-                for at in test_dict[key]:
-                    t_name = t_name_map.get(at.blood_test_id, "Unknown Test")
-                    items_list.append(t_name)
-            else:
-                if appt.appt_type == "follow-up": color = "#F97316"
-
-            start_str = stage.scheduled_time.strftime("%Y-%m-%dT%H:%M:%S")
-            end_str = (stage.scheduled_time + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%S")
-
-            patient_name = patient.name if patient else 'Unknown Patient'
-
-            result.append({
-                "id": str(stage.id),
-                "appt_id": str(appt.id),
-                "title": f"{patient_name} - {service}",
-                "patient_name": patient_name,
-                "stage_name": stage.stage_name, 
-                "start": start_str,
-                "end": end_str,
-                "patient_ic": patient.ic_passport_number if patient else "",
-                "doctor": doctor.name if doctor else "Unassigned",
-                "doctor_ic": str(doctor.ic_passport_number) if doctor else "",
-                "type": appt.appt_type,
-                "service": service,
-                "items": items_list,
-                "dose": dose_val,
-                "total_doses": total_doses,
-                "reason": appt.general_notes or "",
-                "status": stage.status,
-                "color": color,
-                "cancel_reason": stage.cancel_reason
-            })
-        return result
+@app.get("/admin/appointments/{clinic_id}")
+async def admin_get_all_appointments(clinic_id: str, response: Response, start: Optional[str] = None, end: Optional[str] = None, doctor_ic: Optional[str] = None, status: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    # Stays on the primary: the dashboard reloads right after a stage update or cancellation and must see it
+    # Without parameters the full history is returned, as before; the next page cursor (if any) is sent in X-Next-Cursor
+    query = select(models.CalendarEvent).where(models.CalendarEvent.clinic_id == clinic_id)
+    if start: query = query.where(models.CalendarEvent.scheduled_time >= parse_calendar_bound(start))
+    if end: query = query.where(models.CalendarEvent.scheduled_time < parse_calendar_bound(end))
+    if doctor_ic: query = query.where(models.CalendarEvent.doctor_ic == doctor_ic)
+    if status: query = query.where(models.CalendarEvent.status.in_(status.split(",")))
+    if cursor:
+        query = query.where(tuple_(models.CalendarEvent.scheduled_time, models.CalendarEvent.stage_id) > decode_calendar_cursor(cursor))
+    query = query.order_by(models.CalendarEvent.scheduled_time.asc(), models.CalendarEvent.stage_id.asc())
+    if limit: limit = max(1, min(limit, CALENDAR_PAGE_MAX))
+    try:
+        # Rebuilds (and commits) the clinic's events if they drifted; a no-op between checks
+        await db.run_sync(calendar_events.ensure_clinic, clinic_id)
+        events = (await db.execute(query.limit(limit + 1) if limit else query)).scalars().all()
     except Exception as e:
         print(f"DASHBOARD CRASH PREVENTED: {e}")
         return []
+    if limit and len(events) > limit:
+        events = events[:limit]
+        response.headers["X-Next-Cursor"] = encode_calendar_cursor(events[-1])
+    return [calendar_events.serialize(e) for e in events]
 
 @app.put("/admin/appointment-stages/{stage_id}")
 def admin_update_stage(stage_id: str, data: dict, db: Session = Depends(get_db)):
     stage = db.query(models.ApptStage).filter_by(id=stage_id).first()
     if not stage: raise HTTPException(status_code=404)
+    old_time = stage.scheduled_time
     if 'status' in data: 
         stage.status = data['status']
         if data['status'] == 'canceled' and 'cancel_reason' in data:
@@ -981,13 +1065,17 @@ def admin_update_stage(stage_id: str, data: dict, db: Session = Depends(get_db))
         dt_str = data['scheduled_time'].replace("T", " ")
         if len(dt_str) == 16: dt_str += ":00"
         stage.scheduled_time = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+        # A new time deserves a fresh set of reminders
+        if stage.scheduled_time != old_time: stage.reminder_sent = None
         
     if 'doctor_ic' in data:
         appt = db.query(models.Appointment).filter_by(id=stage.appointment_id).first()
         if appt:
             appt.doctor_ic = data['doctor_ic'] if data['doctor_ic'] else None
 
+    calendar_events.refresh_appointments(db, [stage.appointment_id])
     db.commit()
+    invalidate_availability(stage.appointment.clinic_id if stage.appointment else None, old_time, stage.scheduled_time)
     return {"status": "success"}
 
 @app.get("/admin/patients/{clinic_id}")
@@ -1006,6 +1094,9 @@ def admin_update_patient(ic: str, data: PatientUpdate, db: Session = Depends(get
             p.gender = data.gender.upper()
             p.nationality = data.nationality.upper()
             p.address = data.address.upper() if data.address else None
+            db.flush()
+            appt_ids = [a_id for (a_id,) in db.query(models.Appointment.id).filter(models.Appointment.patient_ic.in_([ic, p.ic_passport_number])).all()]
+            calendar_events.refresh_appointments(db, appt_ids)
             db.commit()
         except Exception as e:
             db.rollback()
@@ -1014,12 +1105,15 @@ def admin_update_patient(ic: str, data: PatientUpdate, db: Session = Depends(get
 
 @app.delete("/admin/patients/{ic}")
 def admin_delete_patient(ic: str, db: Session = Depends(get_db)):
+    patient = db.query(models.Patient).filter_by(ic_passport_number=ic).first()
+    clinic_id = patient.clinic_id if patient else None
     db.query(models.Patient).filter_by(ic_passport_number=ic).delete()
     db.commit()
+    invalidate_availability(clinic_id)
     return {"status": "success"}
 
 @app.get("/admin/global-vaccines")
-def get_global_vaccines(db: Session = Depends(get_db)):
+def get_global_vaccines(db: Session = Depends(get_read_db)):
     vaccines = db.query(models.Vaccine).all()
     res = []
     for v in vaccines:
@@ -1033,14 +1127,19 @@ def get_global_vaccines(db: Session = Depends(get_db)):
     return res
 
 @app.post("/admin/ai/vaccine-schedule")
-async def ai_vaccine_schedule(req: VaccineAIRequest):
-    return await generate_vaccine_schedule_ai(req.search_query)
+async def ai_vaccine_schedule(req: VaccineAIRequest, db: AsyncSession = Depends(get_async_db)):
+    known = await db.run_sync(vaccine_knowledge.lookup, req.search_query)
+    if known is not None: return known
+    result = await generate_vaccine_schedule_ai(req.search_query)
+    if "error" not in result: await db.run_sync(vaccine_knowledge.store_llm_answer, req.search_query, result)
+    return result
 
 @app.post("/admin/vaccines")
 def create_vaccine(data: VaccineCreate, db: Session = Depends(get_db)):
     try:
         v_id = data.vaccine_id
         formatted_name = data.name.title() if data.name else None
+        old_name = None
         
         if not v_id and formatted_name:
             existing_v = db.query(models.Vaccine).filter(models.Vaccine.name.ilike(formatted_name)).first()
@@ -1060,6 +1159,7 @@ def create_vaccine(data: VaccineCreate, db: Session = Depends(get_db)):
         elif v_id:
             v = db.query(models.Vaccine).filter_by(id=v_id).first()
             if v:
+                old_name = v.name
                 v.name = formatted_name
                 v.type = normalize_vaccine_type(db, data.type)
                 v.total_doses = data.total_doses
@@ -1069,6 +1169,7 @@ def create_vaccine(data: VaccineCreate, db: Session = Depends(get_db)):
             for sched in data.schedules:
                 db.add(models.VaccineDoseSchedule(vaccine_id=v_id, dose_number=sched.get('dose_number'), interval_description=sched.get('interval_description')))
             db.flush()
+            calendar_events.refresh_appointments(db, [a_id for (a_id,) in db.query(models.AppointmentVaccine.appointment_id).filter_by(vaccine_id=v_id).all()])
 
         existing_vc = db.query(models.VaccineClinic).filter_by(vaccine_id=v_id, clinic_id=data.clinic_id).first()
         if existing_vc:
@@ -1079,6 +1180,7 @@ def create_vaccine(data: VaccineCreate, db: Session = Depends(get_db)):
             vc = models.VaccineClinic(vaccine_id=v_id, clinic_id=data.clinic_id, price=data.price, stock_quantity=data.stock_quantity, low_stock_threshold=data.low_stock_threshold)
             db.add(vc)
             
+        vaccine_knowledge.refresh_vaccine(db, v_id, old_name)
         db.commit()
         return {"status": "success"}
     except Exception as e:
@@ -1089,6 +1191,7 @@ def create_vaccine(data: VaccineCreate, db: Session = Depends(get_db)):
 def update_vaccine(v_id: int, data: VaccineCreate, db: Session = Depends(get_db)):
     try:
         v = db.query(models.Vaccine).filter_by(id=v_id).first()
+        old_name = v.name if v else None
         if v:
             v.name = data.name.title() if data.name else ""
             v.type = normalize_vaccine_type(db, data.type)
@@ -1109,6 +1212,7 @@ def update_vaccine(v_id: int, data: VaccineCreate, db: Session = Depends(get_db)
         db.flush()
 
         now = datetime.now()
+        touched = []
         appt_vacs = db.query(models.AppointmentVaccine).filter_by(vaccine_id=v_id).all()
         for av in appt_vacs:
             appt_id = av.appointment_id
@@ -1148,10 +1252,16 @@ def update_vaccine(v_id: int, data: VaccineCreate, db: Session = Depends(get_db)
                     new_date = calculate_future_date(prev_date, interval)
                     
                 if new_date:
+                    touched.append((stage.appointment.clinic_id, stage.scheduled_time, new_date))
+                    if stage.scheduled_time != new_date: stage.reminder_sent = None
                     stage.scheduled_time = new_date
                     prev_date = new_date
 
+        calendar_events.refresh_appointments(db, [av.appointment_id for av in appt_vacs])
+        vaccine_knowledge.refresh_vaccine(db, v_id, old_name)
         db.commit()
+        for clinic_id, old_date, new_date in touched:
+            invalidate_availability(clinic_id, old_date, new_date)
         return {"status": "success"}
     except Exception as e:
         db.rollback()
@@ -1189,6 +1299,8 @@ def update_bt(bt_id: int, data: BloodTestCreate, db: Session = Depends(get_db)):
                 db.query(models.BloodTestComponent).filter_by(package_id=bt.id).delete()
                 for cid in data.component_ids:
                     db.add(models.BloodTestComponent(package_id=bt.id, test_id=cid))
+            appt_ids = [a_id for (a_id,) in db.query(models.AppointmentBloodTest.appointment_id).filter_by(blood_test_id=bt.id).all()]
+            calendar_events.refresh_appointments(db, appt_ids)
             db.commit()
         return {"status": "success"}
     except Exception as e:
@@ -1197,7 +1309,10 @@ def update_bt(bt_id: int, data: BloodTestCreate, db: Session = Depends(get_db)):
 
 @app.delete("/admin/blood-tests/{bt_id}")
 def delete_bt(bt_id: int, db: Session = Depends(get_db)):
+    # The cascade removes the links, so find the affected appointments first
+    appt_ids = [a_id for (a_id,) in db.query(models.AppointmentBloodTest.appointment_id).filter_by(blood_test_id=bt_id).all()]
     db.query(models.BloodTest).filter_by(id=bt_id).delete()
+    calendar_events.refresh_appointments(db, appt_ids)
     db.commit()
     return {"status": "success"}
 
@@ -1210,9 +1325,8 @@ def admin_add_chatbot_reply(data: AdminChatReply, db: Session = Depends(get_db))
     return {"status": "success"}
 
 @app.post("/ask-admin")
-def ask_admin(msg: ChatMessageModel, db: Session = Depends(get_db)):
-    patient = db.query(models.Patient).filter_by(telegram_id=msg.telegram_id).first()
-    phone = patient.phone if patient else None
+async def ask_admin(msg: ChatMessageModel, db: AsyncSession = Depends(get_async_db)):
+    phone = (await db.execute(select(models.Patient.phone).where(models.Patient.telegram_id == msg.telegram_id).limit(1))).scalar()
     new_msg = models.ChatMessage(
         clinic_id=msg.clinic_id, 
         telegram_id=msg.telegram_id, 
@@ -1222,33 +1336,56 @@ def ask_admin(msg: ChatMessageModel, db: Session = Depends(get_db)):
         status="unread"
     )
     db.add(new_msg)
-    db.commit()
+    await db.commit()
+    await chat_bus.publish_async(new_msg.clinic_id, {"type": "message", "message": chat_message_dict(new_msg)})
+    await chat_bus.publish_async(new_msg.clinic_id, {"type": "pending_count", "delta": 1})
     return {"status": "success"}
 
 @app.get("/admin/chat-pending-count/{clinic_id}")
-def get_pending_chat_count(clinic_id: str, db: Session = Depends(get_db)):
-    count = db.query(models.ChatMessage).filter_by(clinic_id=clinic_id, status='unread').count()
+async def get_pending_chat_count(clinic_id: str, db: AsyncSession = Depends(get_async_db)):
+    count = (await db.execute(select(func.count(models.ChatMessage.id)).where(models.ChatMessage.clinic_id == clinic_id, models.ChatMessage.status == 'unread'))).scalar()
     return {"count": count}
 
+@app.get("/admin/chat-events/{clinic_id}")
+async def chat_event_stream(clinic_id: str, request: Request):
+    """Server-sent events: new/updated chat messages and pending-count deltas for one clinic."""
+    async def event_source():
+        queue = chat_bus.subscribe(clinic_id)
+        try:
+            # Snapshot first so a (re)connecting tab never needs to poll
+            async with AsyncSessionLocal() as db:
+                count = (await db.execute(select(func.count(models.ChatMessage.id)).where(models.ChatMessage.clinic_id == clinic_id, models.ChatMessage.status == 'unread'))).scalar()
+            yield f"data: {json.dumps({'type': 'pending_count', 'count': count})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=CHAT_EVENTS_HEARTBEAT_SECONDS)
+                    yield f"data: {json.dumps(event, default=str)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            chat_bus.unsubscribe(clinic_id, queue)
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/admin/chat-reply")
-async def admin_chat_reply(req: AdminReplyReq, db: Session = Depends(get_db)):
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
+async def admin_chat_reply(req: AdminReplyReq, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
     bot_username = os.getenv("TELEGRAM_BOT_USERNAME", "AICAS_Clinic_Bot")
     
     target_telegram_id = req.telegram_id
     target_phone = req.phone
     channel = 'telegram'
     
+    events = []
     if req.msg_id:
-        msg = db.query(models.ChatMessage).filter_by(id=req.msg_id).first()
+        msg = await db.get(models.ChatMessage, req.msg_id)
         if not msg: raise HTTPException(status_code=404)
+        if msg.status == 'unread': events.append({"type": "pending_count", "delta": -1})
         msg.reply = req.reply_text
         msg.status = 'replied'
         target_telegram_id = msg.telegram_id
         target_phone = msg.phone
         channel = msg.channel or 'telegram'
     elif req.phone:
-        patient = db.query(models.Patient).filter_by(phone=req.phone).first()
+        patient = (await db.execute(select(models.Patient).where(models.Patient.phone == req.phone).limit(1))).scalar()
         if patient and patient.telegram_id:
             target_telegram_id = patient.telegram_id
             target_phone = patient.phone
@@ -1268,50 +1405,28 @@ async def admin_chat_reply(req: AdminReplyReq, db: Session = Depends(get_db)):
         )
         db.add(new_msg)
         
-        db.query(models.ChatMessage).filter_by(phone=target_phone, status='unread').update({"status": "replied"})
-
-    db.commit()
-
-    if channel == 'telegram' and token and target_telegram_id:
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(
-                    f"https://api.telegram.org/bot{token}/sendMessage",
-                    json={"chat_id": target_telegram_id, "text": f"👨‍⚕️ *Clinic Admin:*\n{req.reply_text}", "parse_mode": "Markdown"}
-                )
-            except Exception as e:
-                print(f"Failed to send telegram message: {e}")
+        cleared = (await db.execute(
+            update(models.ChatMessage).where(models.ChatMessage.phone == target_phone, models.ChatMessage.status == 'unread')
+            .values(status="replied").execution_options(synchronize_session=False)
+        )).rowcount
+        if cleared: events.append({"type": "pending_count", "delta": -cleared})
+        events.append({"type": "thread_replied", "phone": target_phone})
+
+    if channel == 'telegram' and target_telegram_id:
+        outbox.enqueue(db, "telegram", target_telegram_id, f"👨‍⚕️ *Clinic Admin:*\n{req.reply_text}", clinic_id=req.clinic_id)
     elif channel == 'sms' and target_phone:
         sms_content = (
             f"Clinic Admin: {req.reply_text}\n\n"
             f"Reply via SMS or use our Telegram Bot for a better experience: https://t.me/{bot_username}"
         )
-        mocean_api_key = os.getenv("MOCEAN_API_KEY")
-        mocean_api_secret = os.getenv("MOCEAN_API_SECRET")
-        
-        if mocean_api_key and mocean_api_secret:
-            try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        "https://rest.moceanapi.com/rest/2/sms",
-                        data={
-                            "mocean-api-key": mocean_api_key,
-                            "mocean-api-secret": mocean_api_secret,
-                            "mocean-to": target_phone,
-                            "mocean-from": "Clinic", 
-                            "mocean-text": sms_content
-                        }
-                    )
-                print(f"Mocean SMS Sent to {target_phone}")
-            except Exception as e:
-                print(f"Failed to send Mocean SMS: {e}")
-        else:
-            print("========== SMS DELIVERY ==========")
-            print(f"TO: {target_phone}")
-            print(f"MESSAGE:\n{sms_content}")
-            print("==================================")
-            print("WARNING: Mocean API keys missing. Fallback to print.")
-                
+        outbox.enqueue(db, "sms", target_phone, sms_content, clinic_id=req.clinic_id)
+
+    await db.commit()
+    kick_outbox(background_tasks)
+    if req.msg_id: events.insert(0, {"type": "message", "message": chat_message_dict(msg)})
+    elif req.phone: events.insert(0, {"type": "message", "message": chat_message_dict(new_msg)})
+    for event in events: await chat_bus.publish_async(req.clinic_id, event)
+
     return {"status": "success", "channel": channel}
 
 @app.post("/ai-extract")
@@ -1327,48 +1442,143 @@ def get_clinic(clinic_id: str, db: Session = Depends(get_db)):
     if not clinic: raise HTTPException(status_code=404)
     return clinic
 
-def get_doctors_and_slots_for_date(db: Session, clinic_id: str, date_obj: datetime.date, duration: int, doctor_pref: str):
-    doc_query = db.query(models.Doctor).join(
-        models.DoctorClinicAvailability, models.Doctor.ic_passport_number == models.DoctorClinicAvailability.doctor_ic
-    ).filter(models.DoctorClinicAvailability.clinic_id == clinic_id)
-    
+def filter_doctor_pref(query, doctor_pref: str):
     if doctor_pref:
         pref_upper = str(doctor_pref).upper()
         if pref_upper == "MALE": 
-            doc_query = doc_query.filter(models.Doctor.gender.ilike("MALE"))
+            query = query.filter(models.Doctor.gender.ilike("MALE"))
         elif pref_upper == "FEMALE": 
-            doc_query = doc_query.filter(models.Doctor.gender.ilike("FEMALE"))
+            query = query.filter(models.Doctor.gender.ilike("FEMALE"))
         elif pref_upper not in ["ANY", "NONE"]: 
-            doc_query = doc_query.filter(models.Doctor.name.ilike(f"%{doctor_pref}%"))
-            
-    valid_docs = doc_query.distinct().all()
-    if not valid_docs: return []
-    
-    day_of_week = date_obj.strftime("%a").lower()[:3] 
+            query = query.filter(models.Doctor.name.ilike(f"%{doctor_pref}%"))
+    return query
+
+def get_doctors_and_slots_for_range(db: Session, clinic_id: str, start_date: datetime.date, end_date: datetime.date, duration: int, doctor_pref: str):
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    day_codes = {day_code(d) for d in days}
+    # One query for every matching doctor's windows across the horizon (was one query per doctor per day)
+    rows = filter_doctor_pref(db.query(models.Doctor, models.DoctorClinicAvailability.day_of_week, models.DoctorClinicAvailability.start_time, models.DoctorClinicAvailability.end_time).join(
+        models.DoctorClinicAvailability, models.Doctor.ic_passport_number == models.DoctorClinicAvailability.doctor_ic
+    ).filter(models.DoctorClinicAvailability.clinic_id == clinic_id, models.DoctorClinicAvailability.day_of_week.in_(day_codes)), doctor_pref).all()
+    result = {d: [] for d in days}
+    if not rows: return result
+
+    doc_map, windows = {}, {}
+    for doc, dow, st, et in rows:
+        doc_map[doc.ic_passport_number] = doc
+        if st and et: windows.setdefault((doc.ic_passport_number, dow), []).append((minute_of(st), minute_of(et)))
+
     now = datetime.now()
-    start_of_day = datetime.combine(date_obj, datetime.min.time())
-    end_of_day = datetime.combine(date_obj, datetime.max.time())
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = datetime.combine(end_date, datetime.max.time())
     
-    clashes = db.query(models.ApptStage.scheduled_time, models.Appointment.doctor_ic).join(models.Appointment).filter(models.Appointment.clinic_id == clinic_id, models.ApptStage.scheduled_time >= start_of_day, models.ApptStage.scheduled_time <= end_of_day).all()
+    clashes = db.query(models.ApptStage.scheduled_time, models.Appointment.doctor_ic).join(models.Appointment).filter(
+        models.Appointment.clinic_id == clinic_id, models.ApptStage.scheduled_time >= range_start, models.ApptStage.scheduled_time <= range_end,
+        models.ApptStage.status != 'canceled'
+    ).all()
     clash_dict = {}
     for c_time, d_ic in clashes:
-        if d_ic not in clash_dict: clash_dict[d_ic] = []
-        clash_dict[d_ic].append(c_time)
-        
-    doc_slots = []
-    for doc in valid_docs:
-        availabilities = db.query(models.DoctorClinicAvailability).filter(models.DoctorClinicAvailability.doctor_ic == doc.ic_passport_number, models.DoctorClinicAvailability.clinic_id == clinic_id, models.DoctorClinicAvailability.day_of_week == day_of_week).all()
-        slots = []
-        for avail in availabilities:
-            if not avail.start_time or not avail.end_time: continue
-            curr = datetime.combine(date_obj, avail.start_time)
-            end_dt = datetime.combine(date_obj, avail.end_time)
-            busy_times = clash_dict.get(doc.ic_passport_number, [])
-            while curr < end_dt:
-                if curr > now and curr not in busy_times: slots.append(curr)
-                curr += timedelta(minutes=duration)
-        if slots: doc_slots.append({"doc": doc, "slots": slots, "free_count": len(slots)})
-    return doc_slots
+        key = (d_ic, c_time.date())
+        if key not in clash_dict: clash_dict[key] = []
+        clash_dict[key].append(c_time)
+
+    for d in days:
+        code = day_code(d)
+        for ic, doc in doc_map.items():
+            slots = slots_for_day(d, windows.get((ic, code), []), clash_dict.get((ic, d), []), duration, now)
+            if slots: result[d].append({"doc": doc, "slots": slots, "free_count": len(slots)})
+    return result
+
+def get_doctors_and_slots_for_date(db: Session, clinic_id: str, date_obj: datetime.date, duration: int, doctor_pref: str):
+    return get_doctors_and_slots_for_range(db, clinic_id, date_obj, date_obj, duration, doctor_pref)[date_obj]
+
+@app.post("/available-dates")
+async def get_available_dates(req: DateRequest, db: AsyncSession = Depends(get_async_db)):
+    today = datetime.now().date()
+    days = [today + timedelta(days=i) for i in range(AVAILABLE_DATES_HORIZON_DAYS)]
+    key = (req.clinic_id.lower(), req.duration, pref_key(req.doctor_pref))
+    missing = day_summaries.missing(key, days, today)
+    if missing:
+        by_day = await db.run_sync(get_doctors_and_slots_for_range, req.clinic_id, min(missing), max(missing), req.duration, req.doctor_pref)
+        day_summaries.update(key, {d: sum(ds["free_count"] for ds in doc_slots) for d, doc_slots in by_day.items()})
+    return [d.strftime("%Y-%m-%d") for d in day_summaries.free_days(key, days)]
+
+def get_cached_day_slots(db: Session, clinic_id: str, date_obj: datetime.date, duration: int, doctor_pref: str):
+    key = (clinic_id.lower(), date_obj, duration, pref_key(doctor_pref))
+    doc_slots = slot_cache.get(key)
+    if doc_slots is None:
+        doc_slots = [{
+            "doctor_id": ds["doc"].ic_passport_number,
+            "doctor_name": ds["doc"].name,
+            "slots": ds["slots"]
+        } for ds in get_doctors_and_slots_for_date(db, clinic_id, date_obj, duration, doctor_pref)]
+        slot_cache.put(key, doc_slots)
+    # Cached entries may outlive some of their slots, so re-apply the "future only" rule on read
+    now = datetime.now()
+    return [{**ds, "slots": [s for s in ds["slots"] if s > now]} for ds in doc_slots]
+
+def check_doctor_pref(db: Session, clinic_id: str, doctor_pref: str) -> Optional[str]:
+    pref_upper = pref_key(doctor_pref)
+    if pref_upper in ["ANY", "NONE", "MALE", "FEMALE"]: return None
+    names = [n for (n,) in filter_doctor_pref(db.query(models.Doctor.name).join(
+        models.DoctorClinicAvailability, models.Doctor.ic_passport_number == models.DoctorClinicAvailability.doctor_ic
+    ).filter(models.DoctorClinicAvailability.clinic_id == clinic_id), doctor_pref).distinct().all()]
+    if not names: return f"No doctor matching '{doctor_pref}' works at this clinic."
+    if len(names) > 1 and pref_upper not in [n.upper() for n in names]:
+        return f"Multiple doctors match '{doctor_pref}': {', '.join(names)}."
+    return None
+
+@app.post("/available-times")
+async def get_available_times(req: TimeRequest, db: AsyncSession = Depends(get_async_db)):
+    date_obj = datetime.strptime(req.date, "%Y-%m-%d").date()
+    doc_slots = await db.run_sync(get_cached_day_slots, req.clinic_id, date_obj, req.duration, req.doctor_pref)
+    times = sorted({s for ds in doc_slots for s in ds["slots"]})
+    return {"date": req.date, "times": [t.strftime("%H:%M:%S") for t in times]}
+
+def get_slot_index(db: Session, clinic_id: str, duration: int, doctor_pref: str, around: datetime.date) -> FreeSlotIndex:
+    today = datetime.now().date()
+    horizon_end = today + timedelta(days=AVAILABLE_DATES_HORIZON_DAYS - 1)
+    in_horizon = today <= around <= horizon_end
+    key = (clinic_id.lower(), None, duration, pref_key(doctor_pref))
+    if in_horizon:
+        index = index_cache.get(key)
+        if index is not None: return index
+        start, end = today, horizon_end
+    else:
+        start, end = max(today, around - timedelta(days=3)), around + timedelta(days=3)
+
+    doc_slots, doc_names = {}, {}
+    for doc_list in get_doctors_and_slots_for_range(db, clinic_id, start, end, duration, doctor_pref).values():
+        for ds in doc_list:
+            doc_slots.setdefault(ds["doc"].ic_passport_number, []).extend(ds["slots"])
+            doc_names[ds["doc"].ic_passport_number] = ds["doc"].name
+    index = FreeSlotIndex(doc_slots, doc_names)
+    if in_horizon: index_cache.put(key, index)
+    return index
+
+@app.post("/check-availability")
+async def check_availability(req: AvailabilityRequest, db: AsyncSession = Depends(get_async_db)):
+    try: req_dt = datetime.strptime(req.requested_time, "%Y-%m-%d %H:%M:%S")
+    except ValueError: return {"is_valid": False, "reason": "Invalid format.", "suggestions": []}
+    now = datetime.now()
+    if req_dt <= now:
+        return {"is_valid": False, "reason": "You cannot book an appointment in the past.", "suggestions": []}
+
+    pref_error = await db.run_sync(check_doctor_pref, req.clinic_id, req.doctor_pref)
+    if pref_error: return {"is_valid": False, "reason": pref_error, "suggestions": []}
+
+    index = await db.run_sync(get_slot_index, req.clinic_id, req.duration, req.doctor_pref, req_dt.date())
+    free_docs = index.doctors_free_at(req_dt)
+    if free_docs:
+        # Spread load: give the booking to the doctor with the most free slots left that day
+        best = max(free_docs, key=lambda ic: index.count_on_day(ic, req_dt.date()))
+        return {"is_valid": True, "reason": "Slot available.", "suggestions": [], "doctor_name": index.doc_names[best], "doctor_id": best}
+
+    return {
+        "is_valid": False,
+        "reason": "The requested time slot is not available.",
+        "suggestions": [s.strftime("%Y-%m-%d %H:%M:%S") for s in index.nearest(req_dt, 3, after=now)]
+    }
 
 @app.get("/admin/doctors-all/{clinic_id}")
 def get_all_doctors(clinic_id: str, db: Session = Depends(get_db)):
@@ -1409,6 +1619,7 @@ def create_doctor(data: DoctorCreateReq, db: Session = Depends(get_db)):
         existing.gender = data.gender
         existing.specialization = data.specialization
         db.flush()
+        calendar_events.refresh_appointments(db, [a_id for (a_id,) in db.query(models.Appointment.id).filter_by(doctor_ic=data.ic).all()])
         
     # Check if doctor is already linked to clinic
     link = db.query(models.DoctorClinicAvailability).filter_by(doctor_ic=data.ic, clinic_id=data.clinic_id, day_of_week='none').first()
@@ -1436,6 +1647,7 @@ def create_doctor(data: DoctorCreateReq, db: Session = Depends(get_db)):
     })
         
     db.commit()
+    invalidate_availability(data.clinic_id)
     return {"status": "success"}
 
 @app.put("/admin/doctors/{ic}")
@@ -1456,8 +1668,10 @@ def update_doctor(ic: str, data: DoctorCreateReq, db: Session = Depends(get_db))
             "status": db_status,
             "resign_reason": db_reason
         })
+        calendar_events.refresh_appointments(db, [a_id for (a_id,) in db.query(models.Appointment.id).filter_by(doctor_ic=ic).all()])
         
         db.commit()
+        invalidate_availability(data.clinic_id)
     return {"status": "success"}
 
 @app.get("/admin/doctors/{ic}/availability/{clinic_id}")
@@ -1490,6 +1704,7 @@ def add_doc_availability(ic: str, data: DoctorScheduleReq, db: Session = Depends
     avail = models.DoctorClinicAvailability(doctor_ic=ic, clinic_id=data.clinic_id, day_of_week=data.day_of_week, start_time=st, end_time=et)
     db.add(avail)
     db.commit()
+    invalidate_availability(data.clinic_id)
     return {"status": "success"}
 
 @app.delete("/admin/doctors/{ic}/availability/{clinic_id}/{day}/{start_time}")
@@ -1497,6 +1712,7 @@ def del_doc_availability(ic: str, clinic_id: str, day: str, start_time: str, db:
     st = datetime.strptime(start_time, "%H:%M").time()
     db.query(models.DoctorClinicAvailability).filter_by(doctor_ic=ic, clinic_id=clinic_id, day_of_week=day, start_time=st).delete()
     db.commit()
+    invalidate_availability(clinic_id)
     return {"status": "success"}
 
 @app.post("/admin/doctors")
@@ -1539,23 +1755,56 @@ def update_doctor(ic: str, data: DoctorCreateReq, db: Session = Depends(get_db))
         db.commit()
     return {"status": "success"}
 
+def resolve_chat_phones(db: Session, telegram_ids) -> Dict[int, str]:
+    """One IN query for every telegram_id on the page instead of one patient lookup per message."""
+    telegram_ids = list({t for t in telegram_ids if t})
+    if not telegram_ids: return {}
+    phones = {}
+    for t_id, p_phone in db.query(models.Patient.telegram_id, models.Patient.phone).filter(models.Patient.telegram_id.in_(telegram_ids), models.Patient.phone.isnot(None)).all():
+        phones.setdefault(t_id, p_phone)
+    return phones
+
 @app.get("/admin/chat-history/{clinic_id}")
-def get_chat_history(clinic_id: str, db: Session = Depends(get_db)):
-    msgs = db.query(models.ChatMessage).filter_by(clinic_id=clinic_id).order_by(models.ChatMessage.created_at.asc()).all()
-    res = []
-    for m in msgs:
-        phone = m.phone
-        if not phone and m.telegram_id:
-            patient = db.query(models.Patient).filter_by(telegram_id=m.telegram_id).first()
-            phone = patient.phone if patient and patient.phone else f"Unknown ({m.telegram_id})"
-        res.append({
-            "id": m.id, 
-            "telegram_id": m.telegram_id, 
-            "phone": phone,
-            "channel": m.channel or 'telegram',
-            "message": m.message, 
-            "reply": m.reply, 
-            "created_at": m.created_at, 
-            "status": m.status
-        })
-    return res
\ No newline at end of file
+async def get_chat_history(clinic_id: str, since_id: Optional[int] = None, limit: Optional[int] = None, db: AsyncSession = Depends(get_async_db)):
+    # Stays on the primary: bot-settings refetches right after posting a reply and must see it
+    query = select(models.ChatMessage).where(models.ChatMessage.clinic_id == clinic_id)
+    if since_id is not None or limit:
+        # Cursor mode: ids are monotonic, so "everything after the last id I saw" is an index range scan
+        if since_id is not None: query = query.where(models.ChatMessage.id > since_id)
+        query = query.order_by(models.ChatMessage.id.asc())
+        if limit: query = query.limit(max(1, min(limit, CHAT_PAGE_MAX)))
+    else:
+        query = query.order_by(models.ChatMessage.created_at.asc())
+    msgs = (await db.execute(query)).scalars().all()
+    phones = await db.run_sync(resolve_chat_phones, [m.telegram_id for m in msgs if not m.phone])
+    return [chat_message_dict(m, m.phone or phones.get(m.telegram_id)) for m in msgs]
+
+@app.get("/admin/chat-conversations/{clinic_id}")
+def get_chat_conversations(clinic_id: str, db: Session = Depends(get_db)):
+    """One row per conversation (grouped the same way as the bot-settings page: by phone)."""
+    rows = db.query(
+        models.ChatMessage.phone,
+        models.ChatMessage.telegram_id,
+        func.count(models.ChatMessage.id),
+        func.sum(case((models.ChatMessage.status == 'unread', 1), else_=0)),
+        func.max(models.ChatMessage.id)
+    ).filter_by(clinic_id=clinic_id).group_by(models.ChatMessage.phone, models.ChatMessage.telegram_id).all()
+    phones = resolve_chat_phones(db, [t_id for phone, t_id, *_ in rows if not phone])
+
+    convs = {}
+    for phone, t_id, total, unread, last_id in rows:
+        key = phone or phones.get(t_id) or (f"Unknown ({t_id})" if t_id else "System")
+        conv = convs.setdefault(key, {"phone": key, "telegram_id": t_id, "message_count": 0, "unread_count": 0, "last_id": 0})
+        conv["message_count"] += total
+        conv["unread_count"] += int(unread or 0)
+        conv["last_id"] = max(conv["last_id"], last_id)
+        conv["telegram_id"] = conv["telegram_id"] or t_id
+
+    last_msgs = {m.id: m for m in db.query(models.ChatMessage).filter(models.ChatMessage.id.in_([c["last_id"] for c in convs.values()])).all()} if convs else {}
+    for conv in convs.values():
+        m = last_msgs.get(conv["last_id"])
+        conv["channel"] = (m.channel if m else None) or 'telegram'
+        conv["last_message"] = m.message if m else None
+        conv["last_reply"] = m.reply if m else None
+        conv["last_at"] = m.created_at if m else None
+    return sorted(convs.values(), key=lambda c: c["last_id"], reverse=True)
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, BigInteger, Numeric, Boolean, Time
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import text, Column, String, DateTime, ForeignKey, Integer, BigInteger, Numeric, Boolean, Time, Index
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 import uuid
 import datetime
 from database import Base
 
+DEFAULT_TIMEZONE = "Asia/Kuala_Lumpur"
+
 class Clinic(Base):
     __tablename__ = "clinics"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -12,6 +14,8 @@ class Clinic(Base):
     registration_number = Column(String(100))
     address = Column(String)
     contact_number = Column(String(20))
+    # IANA zone name; appointment times are stored as naive clinic-local times
+    timezone = Column(String(50), default=DEFAULT_TIMEZONE)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 class User(Base):
@@ -62,6 +66,7 @@ class Patient(Base):
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (Index("ix_appointments_clinic_id", "clinic_id", "id"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     clinic_id = Column(UUID(as_uuid=True), ForeignKey("clinics.id", ondelete="CASCADE"), nullable=False)
     patient_ic = Column(String(20), ForeignKey("patients.ic_passport_number", ondelete="CASCADE"), nullable=False)
@@ -74,6 +79,7 @@ class Appointment(Base):
 
 class ApptStage(Base):
     __tablename__ = "appointment_stages"
+    __table_args__ = (Index("ix_appointment_stages_time_appt", "scheduled_time", "appointment_id"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     appointment_id = Column(UUID(as_uuid=True), ForeignKey("appointments.id", ondelete="CASCADE"))
     stage_name = Column(String(100))
@@ -81,6 +87,8 @@ class ApptStage(Base):
     status = Column(String(20), default="scheduled")
     cancel_reason = Column(String(255), nullable=True)
     depends_on_stage_id = Column(UUID(as_uuid=True), ForeignKey("appointment_stages.id"), nullable=True)
+    # Lead time (minutes) of the most recent reminder sent for this time; NULL until the first one goes out
+    reminder_sent = Column(Integer, nullable=True)
     appointment = relationship("Appointment", back_populates="stages")
 
 class AgentLog(Base):
@@ -91,6 +99,23 @@ class AgentLog(Base):
     reasoning = Column(String)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
+class OutboundMessage(Base):
+    __tablename__ = "outbound_messages"
+    __table_args__ = (Index("ix_outbound_messages_due", "status", "next_attempt_at"),)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    clinic_id = Column(UUID(as_uuid=True), ForeignKey("clinics.id", ondelete="CASCADE"), nullable=True)
+    channel = Column(String(20), nullable=False)  # telegram | sms | email
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=True)
+    body = Column(String, nullable=False)
+    sensitive = Column(Boolean, default=False)
+    status = Column(String(20), default='pending')  # pending | sending | sent | mocked | failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class BloodTest(Base):
     __tablename__ = "blood_tests"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -163,4 +188,57 @@ class VaccineDoseSchedule(Base):
 class BloodTestComponent(Base):
     __tablename__ = "blood_test_components"
     package_id = Column(Integer, ForeignKey("blood_tests.id", ondelete="CASCADE"), primary_key=True)
-    test_id = Column(Integer, ForeignKey("blood_tests.id", ondelete="CASCADE"), primary_key=True)
\ No newline at end of file
+    test_id = Column(Integer, ForeignKey("blood_tests.id", ondelete="CASCADE"), primary_key=True)
+
+class CalendarEvent(Base):
+    __tablename__ = "calendar_events"
+    __table_args__ = (Index("ix_calendar_events_clinic_time", "clinic_id", "scheduled_time", "stage_id"),)
+    stage_id = Column(UUID(as_uuid=True), ForeignKey("appointment_stages.id", ondelete="CASCADE"), primary_key=True)
+    appointment_id = Column(UUID(as_uuid=True), ForeignKey("appointments.id", ondelete="CASCADE"), nullable=False, index=True)
+    clinic_id = Column(UUID(as_uuid=True), ForeignKey("clinics.id", ondelete="CASCADE"), nullable=False)
+    scheduled_time = Column(DateTime, nullable=False)
+    title = Column(String)
+    patient_name = Column(String(255))
+    patient_ic = Column(String(20))
+    doctor_name = Column(String(255))
+    doctor_ic = Column(String(20))
+    appt_type = Column(String(50))
+    service = Column(String(20))
+    items = Column(JSONB, default=list)
+    stage_name = Column(String(100))
+    # appointment_vaccines.dose_number verbatim (same type); NULL when the API reports the stage name instead
+    dose = Column(String(50))
+    total_doses = Column(Integer)
+    reason = Column(String(255))
+    status = Column(String(20))
+    color = Column(String(10))
+    cancel_reason = Column(String(255), nullable=True)
+
+class VaccineKnowledge(Base):
+    __tablename__ = "vaccine_knowledge"
+    query_key = Column(String(255), primary_key=True)
+    payload = Column(JSONB, nullable=False)
+    source = Column(String(20), default='llm')
+    vaccine_id = Column(Integer, ForeignKey("vaccines.id", ondelete="CASCADE"), nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+def ensure_schema(engine):
+    """Brings an existing database up to these models. Run by both the API (at startup) and the Celery worker,
+    since the reminder agent reads columns the API may not have added yet. Every statement is idempotent."""
+    # Only creates missing tables (e.g. calendar_events); existing tables are left untouched
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist, so add the range-query indexes explicitly
+    for table in (Appointment.__table__, ApptStage.__table__, CalendarEvent.__table__):
+        for idx in table.indexes:
+            idx.create(bind=engine, checkfirst=True)
+    # Same for columns added to existing tables
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE appointment_stages ADD COLUMN IF NOT EXISTS reminder_sent INTEGER"))
+        conn.execute(text(f"ALTER TABLE clinics ADD COLUMN IF NOT EXISTS timezone VARCHAR(50) DEFAULT '{DEFAULT_TIMEZONE}'"))
+        # calendar_events.title was VARCHAR(255) when the table first shipped; only altered while it still is
+        conn.execute(text(
+            "DO $$ BEGIN "
+            "IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'calendar_events' AND column_name = 'title' AND character_maximum_length IS NOT NULL) THEN "
+            "ALTER TABLE calendar_events ALTER COLUMN title TYPE VARCHAR; END IF; "
+            "END $$"
+        ))
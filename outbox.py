@@ -0,0 +1,191 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+import httpx
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import models
+
+# --- OUTBOUND NOTIFICATION QUEUE ---
+# API handlers and the reminder agent only insert outbound_messages rows (in the same transaction as the change
+# that caused them). The dispatcher claims due rows, sends them through Telegram / Mocean SMS / SendGrid with
+# per-channel rate limits and retries, and records the outcome on the row.
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_SEND_RETRIES = int(os.getenv("OUTBOX_SEND_RETRIES", "2"))
+# A claimed row whose dispatcher died is picked up again after the lease runs out
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_DRAIN_SECONDS = float(os.getenv("OUTBOX_DRAIN_SECONDS", "50"))
+# API handlers send only a few rows inline after their response; the Celery sweep takes care of the rest
+OUTBOX_INLINE_BATCH_SIZE = int(os.getenv("OUTBOX_INLINE_BATCH_SIZE", "10"))
+
+# Requests per second and in-flight requests per channel, enforced per process (every uvicorn worker and Celery
+# child has its own budget, so size them for the number of processes). Telegram allows roughly 30 messages/second per bot.
+CHANNEL_LIMITS = {
+    "telegram": (float(os.getenv("TELEGRAM_RATE_PER_SECOND", "25")), int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "20"))),
+    "sms": (float(os.getenv("SMS_RATE_PER_SECOND", "5")), int(os.getenv("SMS_MAX_CONCURRENCY", "5"))),
+    "email": (float(os.getenv("EMAIL_RATE_PER_SECOND", "10")), int(os.getenv("EMAIL_MAX_CONCURRENCY", "10"))),
+}
+
+def enqueue(db: Session, channel: str, recipient, body: str, subject: str = None, clinic_id=None, sensitive: bool = False) -> models.OutboundMessage:
+    """Adds the message to the session; it is sent once the caller commits. Sensitive bodies are redacted after delivery."""
+    msg = models.OutboundMessage(
+        channel=channel, recipient=str(recipient), subject=subject, body=body,
+        clinic_id=clinic_id, sensitive=sensitive, status="pending", attempts=0, next_attempt_at=datetime.utcnow()
+    )
+    db.add(msg)
+    return msg
+
+class RateLimiter:
+    """Evenly spaced send slots: at most `rate` requests start per second across all senders in this process.
+    The slot is reserved under a thread lock, so one limiter is shared by every event loop (Celery runs a new
+    loop per task) and every concurrent dispatch_batch."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Books the next slot and returns how long to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        return delay
+
+    async def wait(self):
+        delay = self.reserve()
+        if delay > 0: await asyncio.sleep(delay)
+
+rate_limiters = {ch: RateLimiter(rate) for ch, (rate, _) in CHANNEL_LIMITS.items()}
+# asyncio semaphores belong to one event loop, so the concurrency caps are kept per loop (one per API process)
+_loop_semaphores = weakref.WeakKeyDictionary()
+
+def channel_semaphores() -> dict:
+    loop = asyncio.get_running_loop()
+    if loop not in _loop_semaphores:
+        _loop_semaphores[loop] = {ch: asyncio.Semaphore(conc) for ch, (_, conc) in CHANNEL_LIMITS.items()}
+    return _loop_semaphores[loop]
+
+# --- CHANNEL REQUESTS ---
+# Each returns the httpx request kwargs for one message, or None when the provider is not configured
+def telegram_request(msg: models.OutboundMessage):
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token: return None
+    return {"method": "POST", "url": f"https://api.telegram.org/bot{token}/sendMessage",
+            "json": {"chat_id": msg.recipient, "text": msg.body, "parse_mode": "Markdown"}}
+
+def sms_request(msg: models.OutboundMessage):
+    api_key, api_secret = os.getenv("MOCEAN_API_KEY"), os.getenv("MOCEAN_API_SECRET")
+    if not (api_key and api_secret): return None
+    return {"method": "POST", "url": "https://rest.moceanapi.com/rest/2/sms",
+            "data": {"mocean-api-key": api_key, "mocean-api-secret": api_secret,
+                     "mocean-to": msg.recipient, "mocean-from": "Clinic", "mocean-text": msg.body}}
+
+def email_request(msg: models.OutboundMessage):
+    api_key, from_email = os.getenv("SENDGRID_API_KEY"), os.getenv("SENDGRID_FROM_EMAIL")
+    if not (api_key and from_email): return None
+    return {"method": "POST", "url": "https://api.sendgrid.com/v3/mail/send",
+            "headers": {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            "json": {"personalizations": [{"to": [{"email": msg.recipient}], "subject": msg.subject or ""}],
+                     "from": {"email": from_email, "name": "AICAS System"},
+                     "content": [{"type": "text/plain", "value": msg.body}]}}
+
+CHANNEL_REQUESTS = {"telegram": telegram_request, "sms": sms_request, "email": email_request}
+
+def retry_after_of(response: httpx.Response):
+    try:
+        # Telegram puts it in the body, SendGrid/Mocean in the header
+        return response.json().get("parameters", {}).get("retry_after") or float(response.headers.get("retry-after", 0)) or None
+    except (ValueError, AttributeError):
+        return None
+
+async def send_one(client: httpx.AsyncClient, limiter: RateLimiter, sem: asyncio.Semaphore, msg: models.OutboundMessage) -> tuple:
+    """Returns (status, error). 429/5xx/transport errors are retried in place; a 4xx is final."""
+    request = CHANNEL_REQUESTS[msg.channel](msg)
+    if request is None:
+        print(f"========== {msg.channel.upper()} DELIVERY (provider not configured) ==========")
+        print(f"TO: {msg.recipient}")
+        print(f"MESSAGE:\n{msg.body}")
+        return "mocked", None
+
+    error = None
+    async with sem:
+        for attempt in range(OUTBOX_SEND_RETRIES + 1):
+            await limiter.wait()
+            try:
+                response = await client.request(**request)
+            except httpx.TransportError as e:
+                response, error = None, f"transport: {e}"
+            if response is not None:
+                if response.status_code in (200, 202, 204): return "sent", None
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code != 429 and response.status_code < 500: return "failed", error
+            if attempt == OUTBOX_SEND_RETRIES: break
+            retry_after = retry_after_of(response) if response is not None and response.status_code == 429 else None
+            await asyncio.sleep(retry_after or (2 ** attempt) + random.random())
+    return "retry", error
+
+# --- DISPATCHER ---
+def claim_batch(db: Session, limit: int) -> list:
+    now = datetime.utcnow()
+    due = select(models.OutboundMessage.id).where(
+        models.OutboundMessage.status.in_(("pending", "sending")),
+        models.OutboundMessage.next_attempt_at <= now
+    ).order_by(models.OutboundMessage.id).limit(limit).with_for_update(skip_locked=True)
+    claimed = db.execute(
+        update(models.OutboundMessage).where(models.OutboundMessage.id.in_(due.scalar_subquery()))
+        .values(status="sending", attempts=models.OutboundMessage.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        .returning(models.OutboundMessage.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    messages = db.query(models.OutboundMessage).filter(models.OutboundMessage.id.in_(claimed)).all() if claimed else []
+    # Detach before committing so the loaded rows are not expired and can be read outside the session
+    for m in messages: db.expunge(m)
+    db.commit()
+    return messages
+
+def record_results(db: Session, results: list):
+    now = datetime.utcnow()
+    rows = []
+    for msg, (status, error) in results:
+        row = {"id": msg.id, "last_error": error}
+        if status == "retry" and msg.attempts < OUTBOX_MAX_ATTEMPTS:
+            row.update(status="pending", next_attempt_at=now + timedelta(seconds=30 * 2 ** msg.attempts))
+        else:
+            row.update(status="failed" if status == "retry" else status)
+            if status in ("sent", "mocked"): row["sent_at"] = now
+            if msg.sensitive: row["body"] = "[redacted]"
+        rows.append(row)
+    db.bulk_update_mappings(models.OutboundMessage, rows)
+    db.commit()
+
+async def dispatch_batch(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """Claims and sends up to `limit` due messages. Returns how many were claimed."""
+    db: Session = SessionLocal()
+    try:
+        messages = await asyncio.to_thread(claim_batch, db, limit)
+        if not messages: return 0
+        semaphores = channel_semaphores()
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            statuses = await asyncio.gather(*[send_one(client, rate_limiters[m.channel], semaphores[m.channel], m) for m in messages])
+        await asyncio.to_thread(record_results, db, list(zip(messages, statuses)))
+        return len(messages)
+    finally:
+        db.close()
+
+async def drain(budget: float = OUTBOX_DRAIN_SECONDS) -> int:
+    """Dispatches batches until the queue has nothing due or the time budget is spent."""
+    deadline = time.monotonic() + budget
+    total = 0
+    while time.monotonic() < deadline:
+        claimed = await dispatch_batch()
+        total += claimed
+        if claimed < OUTBOX_BATCH_SIZE: break
+    return total
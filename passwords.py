@@ -0,0 +1,105 @@
+import os
+import hmac
+import hashlib
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+# --- PASSWORD HASHING ---
+# bcrypt runs in a small process pool so a burst of logins cannot occupy every request thread or the GIL.
+# At most HASH_MAX_PENDING hashes wait for the pool; beyond that callers get HashingBusy instead of queueing.
+# Async routes await the *_async variants, so no request thread is held while a hash runs.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_WORKERS * 4)))
+HASH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("HASH_QUEUE_TIMEOUT_SECONDS", "5"))
+# Verification codes are short-lived and random, so a keyed HMAC is enough and costs microseconds
+VERIFICATION_CODE_KEY = (os.getenv("VERIFICATION_CODE_KEY") or os.getenv("JWT_SECRET", "super-secret-aicas-key-change-me")).encode()
+
+class HashingBusy(Exception):
+    pass
+
+def _checkpw(plain: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(plain, hashed)
+
+def _hashpw(plain: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(plain, bcrypt.gensalt(rounds=rounds))
+
+class HashingPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use, one per server worker process. Spawned rather than forked: by then the process
+        # runs the event loop and listener threads, and forking a threaded process can deadlock the child.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=HASH_QUEUE_TIMEOUT_SECONDS): raise HashingBusy()
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    async def run_async(self, fn, *args):
+        # Only a caller that finds the queue full waits (in a thread) for a slot
+        if not self._slots.acquire(blocking=False) and not await asyncio.to_thread(self._slots.acquire, True, HASH_QUEUE_TIMEOUT_SECONDS):
+            raise HashingBusy()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None: self._executor.shutdown(wait=False)
+            self._executor = None
+
+hashing_pool = HashingPool(HASH_WORKERS, HASH_MAX_PENDING)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return hashing_pool.run(_checkpw, plain_password.encode('utf-8')[:72], hashed_password.encode('utf-8'))
+    except HashingBusy:
+        raise
+    except Exception as e:
+        print(f"Bcrypt verify error: {e}")
+        return False
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await hashing_pool.run_async(_checkpw, plain_password.encode('utf-8')[:72], hashed_password.encode('utf-8'))
+    except HashingBusy:
+        raise
+    except Exception as e:
+        print(f"Bcrypt verify error: {e}")
+        return False
+
+def get_password_hash(password: str) -> str:
+    return hashing_pool.run(_hashpw, password.encode('utf-8')[:72], BCRYPT_ROUNDS).decode('utf-8')
+
+async def get_password_hash_async(password: str) -> str:
+    return (await hashing_pool.run_async(_hashpw, password.encode('utf-8')[:72], BCRYPT_ROUNDS)).decode('utf-8')
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when the stored hash is not bcrypt at BCRYPT_ROUNDS (e.g. "$2b$10$..." after raising the cost, or a legacy plaintext)."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+def code_digest(ic: str, code: str) -> str:
+    return hmac.new(VERIFICATION_CODE_KEY, f"{ic}:{code}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+async def verify_code_digest(ic: str, code: str, stored: str) -> bool:
+    # Codes issued before the switch to HMAC are bcrypt hashes; they expire within 15 minutes
+    if stored.startswith("$2"): return await verify_password_async(code, stored)
+    return hmac.compare_digest(code_digest(ic, code), stored)
@@ -0,0 +1,137 @@
+import pytest
+
+import agent
+from agent import fast_parse_appointment, calculate_exact_datetime, FAST_PATH_MIN_CONFIDENCE
+
+# --- deterministic fast path ---
+@pytest.mark.parametrize("text, expected", [
+    ("I want to book tomorrow 10am", {"intent": "booking", "raw_date_text": "tomorrow", "raw_time_text": "10:00 am"}),
+    ("day after tomorrow 2pm", {"intent": "booking", "raw_date_text": "in 2 days", "raw_time_text": "2:00 pm"}),
+    ("can i see a female doctor on next monday at 3:30pm for fever",
+     {"raw_date_text": "next monday", "raw_time_text": "3:30 pm", "doctor_preference": "FEMALE", "general_notes": "fever"}),
+    ("reschedule to 12/3 noon", {"intent": "reschedule", "raw_date_text": "12/3", "raw_time_text": "12:00 pm"}),
+    ("cancel my appointment", {"intent": "cancel"}),
+    ("where is the clinic?", {"intent": "question", "raw_date_text": None}),
+])
+def test_fast_path_handles_common_phrases(text, expected):
+    data, confidence = fast_parse_appointment(text)
+    assert {k: data[k] for k in expected} == expected
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+def test_unrecognized_text_falls_through_to_the_llm():
+    _, confidence = fast_parse_appointment("something the parser cannot understand at all")
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
+
+@pytest.mark.parametrize("text", [
+    "i would like to book an appointment with dr tan tomorrow at 10am",  # named doctor
+    "book with dr. may tomorrow 10am",  # a name that is also an English word
+    "i would like to book an appointment tomorrow at 10am please because of my knee",  # unlisted complaint
+    "i would like to book an appointment for my son tomorrow 10am",  # who the visit is for
+    "i would like to book a vaccine appointment tomorrow at 10am",  # service
+    "i want to see a doctor tomorrow morning",  # only a time of day, no exact time
+])
+def test_partially_understood_messages_go_to_the_llm(text):
+    _, confidence = fast_parse_appointment(text)
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
+
+def test_time_of_day_and_doctor_words_are_fine_once_parsed():
+    assert fast_parse_appointment("tomorrow morning at 10am please")[1] >= FAST_PATH_MIN_CONFIDENCE
+    data, confidence = fast_parse_appointment("with the female doctor tomorrow 9am")
+    assert data["doctor_preference"] == "FEMALE" and confidence >= FAST_PATH_MIN_CONFIDENCE
+
+def test_fast_path_output_resolves_against_now():
+    data, _ = fast_parse_appointment("book tomorrow 10am")
+    assert calculate_exact_datetime(data["raw_date_text"], data["raw_time_text"], "2030-01-07 09:00:00") == ("2030-01-08", "10:00:00")
+
+# --- adaptive hedged race ---
+from agent import BackendHealth, ranked_backends, run_llm_race
+import asyncio
+
+def backend(name, delay, prior, result=None, error=None):
+    async def fetch(prompt):
+        await asyncio.sleep(delay)
+        if error: raise error
+        return result or name
+    return BackendHealth(name, fetch, prior_latency=prior)
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setattr(agent, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(agent, "HEDGE_DEFAULT_DELAY", 0.02)
+    registry = {}
+    monkeypatch.setattr(agent, "llm_backends", registry)
+    return registry
+
+def test_cancelled_call_only_raises_the_latency_estimate():
+    b = backend("b", 0, prior=1.0)
+    b.record_cancelled(0.5)
+    assert b.ewma_latency == 1.0
+    b.record_cancelled(6.0)
+    assert b.ewma_latency == pytest.approx(0.2 * 6.0 + 0.8 * 1.0)
+    assert list(b.samples) == [0.5, 6.0]
+
+def test_hedge_fires_after_p95_and_fastest_answer_wins(backends):
+    backends.update(local=backend("Local_LLM", 1.0, prior=1.0), gemini=backend("Gemini_LLM", 0, prior=1.5))
+    assert asyncio.run(run_llm_race("p")) == "Gemini_LLM"
+    assert len(backends["local"].samples) == 1
+
+def test_backend_that_keeps_losing_drops_in_the_ranking(backends):
+    # Local starts ahead and never finishes; Gemini answers ~40ms after it is hedged in, so its own estimate stays
+    # above local's prior and only the censored samples can move local down
+    backends.update(local=backend("Local_LLM", 1.0, prior=0.01), gemini=backend("Gemini_LLM", 0.04, prior=0.05))
+    for _ in range(15):
+        asyncio.run(run_llm_race("p"))
+    assert backends["gemini"].ewma_latency > 0.01
+    assert ranked_backends()[0] is backends["gemini"]
+
+def test_failure_falls_back_immediately_and_opens_the_circuit(backends, monkeypatch):
+    monkeypatch.setattr(agent, "CIRCUIT_FAILURE_THRESHOLD", 2)
+    backends.update(local=backend("Local_LLM", 0, prior=1.0, error=RuntimeError("down")), gemini=backend("Gemini_LLM", 0, prior=1.5))
+    for _ in range(2):
+        assert asyncio.run(run_llm_race("p")) == "Gemini_LLM"
+    assert not backends["local"].available()
+    assert ranked_backends() == [backends["gemini"]]
+
+# --- single flight ---
+from agent import single_flight
+
+def test_concurrent_callers_share_one_call_and_the_entry_is_dropped():
+    calls = []
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+    async def main():
+        results = await asyncio.gather(*(single_flight("same prompt", fetch) for _ in range(5)))
+        assert agent._in_flight == {}
+        # The next caller after completion starts a fresh call rather than reusing the old result
+        assert await single_flight("same prompt", fetch) == "answer"
+        return results
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 2 and agent._in_flight == {}
+
+def test_leader_error_reaches_every_follower():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("backend down")
+    async def main():
+        return await asyncio.gather(*(single_flight("failing prompt", fetch) for _ in range(3)), return_exceptions=True)
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) and str(r) == "backend down" for r in results)
+    assert agent._in_flight == {}
+
+def test_cancelling_one_follower_leaves_the_shared_call_running():
+    calls = []
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "answer"
+    async def main():
+        leader = asyncio.create_task(single_flight("slow prompt", fetch))
+        follower = asyncio.create_task(single_flight("slow prompt", fetch))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError): await follower
+        return await leader
+    assert asyncio.run(main()) == "answer"
+    assert len(calls) == 1 and agent._in_flight == {}
@@ -0,0 +1,118 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import auth_cache
+import main
+import models
+from auth_cache import PrincipalCache
+
+def principal(ic, role="staff", status="active"):
+    return {"ic_passport_number": ic, "name": ic, "email": None, "role": role, "clinic_id": "c1", "permissions": "ALL", "status": status}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth_cache, "monotonic", lambda: now[0])
+    return now
+
+# --- cache unit behaviour ---
+def test_entries_expire_after_ttl(clock):
+    cache = PrincipalCache(ttl=30)
+    cache.put("A1", "c1", principal("A1"))
+    clock[0] += 29
+    assert cache.get("A1", "c1")["role"] == "staff"
+    clock[0] += 2
+    assert cache.get("A1", "c1") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1}
+
+def test_invalidate_by_sub_drops_that_user_in_every_clinic():
+    # Password and role changes invalidate by sub
+    cache = PrincipalCache()
+    for sub, clinic in [("A1", "c1"), ("A1", "c2"), ("B1", "c1")]:
+        cache.put(sub, clinic, principal(sub))
+    cache.invalidate(sub="A1")
+    assert cache.get("A1", "c1") is None and cache.get("A1", "c2") is None
+    assert cache.get("B1", "c1") is not None
+
+def test_invalidate_by_clinic_drops_every_user_of_that_clinic():
+    # Clinic updates (temporary admin deactivation, deletion) invalidate by clinic
+    cache = PrincipalCache()
+    for sub, clinic in [("A1", "c1"), ("B1", "c1"), ("A1", "c2")]:
+        cache.put(sub, clinic, principal(sub))
+    cache.invalidate(clinic_id="c1")
+    assert cache.get("A1", "c1") is None and cache.get("B1", "c1") is None
+    assert cache.get("A1", "c2") is not None
+
+def test_invalidate_without_arguments_clears_everything():
+    cache = PrincipalCache()
+    cache.put("A1", "c1", principal("A1"))
+    cache.put("B1", "c2", principal("B1"))
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PrincipalCache(maxsize=2)
+    cache.put("A1", "c1", principal("A1"))
+    cache.put("B1", "c1", principal("B1"))
+    cache.get("A1", "c1")
+    cache.put("C1", "c1", principal("C1"))
+    assert cache.get("B1", "c1") is None
+    assert cache.get("A1", "c1") is not None and cache.get("C1", "c1") is not None
+
+# --- get_current_user with the cache in front ---
+@pytest.fixture
+def staff_db(monkeypatch):
+    """SQLite copy of the tables resolve_principal reads, with one active staff member and a fresh principal cache."""
+    monkeypatch.setattr(main, "principal_cache", PrincipalCache())
+    engine = create_engine("sqlite://")
+    for model in (models.Clinic, models.User, models.ClinicStaff):
+        model.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+    clinic_id = uuid.uuid4()
+    db.add(models.Clinic(id=clinic_id, name="Alpha Clinic", registration_number="REG-1"))
+    db.add(models.User(ic_passport_number="S1", name="STAFF ONE", email="s1@x.com", password_hash="old"))
+    db.add(models.ClinicStaff(ic_passport_number="S1", clinic_id=clinic_id, role="staff", status="active", permissions="calendar"))
+    db.commit()
+    # SQLite binds UUID columns only from uuid.UUID (Postgres takes the token's string), so decode to one
+    payload = {"sub": "S1", "clinic_id": clinic_id}
+    monkeypatch.setattr(main.jwt, "decode", lambda *args, **kwargs: dict(payload))
+    yield db, clinic_id, "Bearer test-token"
+    db.close()
+
+def staff_row(db):
+    return db.query(models.ClinicStaff).filter_by(ic_passport_number="S1").one()
+
+def test_cached_principal_is_served_until_invalidated(staff_db):
+    db, _, auth = staff_db
+    assert main.get_current_user(auth, db).role == "staff"
+    staff_row(db).role = "temporary_admin"
+    db.commit()
+    # Within the TTL and without an invalidation the old role is still served from the cache
+    assert main.get_current_user(auth, db).role == "staff"
+    main.principal_cache.invalidate(sub="S1")
+    assert main.get_current_user(auth, db).role == "temporary_admin"
+
+def test_deactivation_takes_effect_after_clinic_invalidation(staff_db):
+    db, clinic_id, auth = staff_db
+    main.get_current_user(auth, db)
+    staff_row(db).status = "inactive"
+    db.commit()
+    main.principal_cache.invalidate(clinic_id=clinic_id)
+    with pytest.raises(HTTPException) as e:
+        main.get_current_user(auth, db)
+    assert e.value.status_code == 403
+    # Rejected principals are never cached, so reactivation is seen on the next request
+    assert main.principal_cache.stats()["size"] == 0
+
+def test_password_change_drops_the_cached_principal(staff_db):
+    db, clinic_id, auth = staff_db
+    main.get_current_user(auth, db)
+    assert main.principal_cache.get("S1", clinic_id) is not None
+    db.query(models.User).filter_by(ic_passport_number="S1").one().password_hash = "new"
+    db.commit()
+    main.principal_cache.invalidate(sub="S1")
+    assert main.principal_cache.get("S1", clinic_id) is None
@@ -0,0 +1,140 @@
+import random
+from datetime import date, datetime, timedelta
+
+from availability import (
+    MINUTES_PER_DAY, window_mask, grid_mask, spread_back, future_mask, iter_bits, busy_mask, free_slot_mask, slots_for_day,
+)
+
+DAY = date(2030, 1, 7)
+BEFORE = datetime(2030, 1, 6, 12, 0)
+
+def at(h, m=0, day=DAY):
+    return datetime(day.year, day.month, day.day, h, m)
+
+def reference_slots(day, windows, busy_times, duration, now):
+    """The pre-bitset algorithm: walk each window in duration steps and reject any slot a booking starts inside."""
+    busy = {b.hour * 60 + b.minute for b in busy_times}
+    slots = set()
+    for start, end in windows:
+        for m in range(start, end, duration):
+            slot = datetime.combine(day, datetime.min.time()) + timedelta(minutes=m)
+            if slot > now and not any(m <= b < m + duration for b in busy): slots.add(slot)
+    return sorted(slots)
+
+# --- bitset primitives ---
+def test_window_mask_covers_half_open_range():
+    assert list(iter_bits(window_mask(3, 6))) == [3, 4, 5]
+    assert window_mask(6, 6) == 0
+    assert window_mask(7, 6) == 0
+
+def test_grid_mask_steps_from_window_start():
+    assert list(iter_bits(grid_mask(540, 600, 15))) == [540, 555, 570, 585]
+    assert grid_mask(540, 540, 15) == 0
+
+def test_spread_back_marks_every_start_that_would_overlap():
+    # A booking starting at minute 10 blocks 30-minute slots starting at minutes 0..10
+    assert list(iter_bits(spread_back(1 << 10, 30))) == list(range(0, 11))
+    assert list(iter_bits(spread_back(1 << 100, 1))) == [100]
+
+def test_future_mask():
+    assert future_mask(DAY, at(9, 0, DAY + timedelta(days=1))) == 0
+    assert future_mask(DAY, BEFORE) == (1 << MINUTES_PER_DAY) - 1
+    # Strictly after now: 09:00 itself is gone, 09:01 is still offered
+    mask = future_mask(DAY, at(9, 0))
+    assert not mask >> 540 & 1 and mask >> 541 & 1
+
+def test_busy_mask_uses_start_minute():
+    assert list(iter_bits(busy_mask([at(9, 0), at(13, 30)]))) == [540, 810]
+
+# --- free slots ---
+def test_booking_blocks_only_overlapping_slots():
+    slots = slots_for_day(DAY, [(540, 660)], [at(9, 40)], 30, BEFORE)
+    assert slots == [at(9, 0), at(10, 0), at(10, 30)]
+
+def test_slots_are_limited_to_the_future():
+    slots = slots_for_day(DAY, [(540, 660)], [], 30, at(9, 45))
+    assert slots == [at(10, 0), at(10, 30)]
+
+def test_no_windows_means_no_slots():
+    assert free_slot_mask([], 0, 30, (1 << MINUTES_PER_DAY) - 1) == 0
+    assert slots_for_day(DAY, [], [], 30, BEFORE) == []
+
+def test_matches_reference_on_random_days():
+    rng = random.Random(20300107)
+    for _ in range(300):
+        duration = rng.choice([10, 15, 20, 30, 45, 60])
+        windows = []
+        for _ in range(rng.randint(1, 3)):
+            start = rng.randrange(0, MINUTES_PER_DAY - 60)
+            windows.append((start, min(MINUTES_PER_DAY, start + rng.randint(30, 480))))
+        busy = [at(0) + timedelta(minutes=rng.randrange(MINUTES_PER_DAY)) for _ in range(rng.randint(0, 12))]
+        now = at(0) + timedelta(minutes=rng.randrange(-60, MINUTES_PER_DAY))
+        assert slots_for_day(DAY, windows, busy, duration, now) == reference_slots(DAY, windows, busy, duration, now)
+
+# --- per-day summaries ---
+from availability import DaySummaryStore, pref_key
+import availability
+
+def test_summary_serves_stored_days_except_today():
+    store = DaySummaryStore()
+    key = ("clinic-a", 30, pref_key(None))
+    days = [DAY, DAY + timedelta(days=1), DAY + timedelta(days=2)]
+    assert store.missing(key, days, today=DAY) == days
+    store.update(key, {DAY: 3, days[1]: 0, days[2]: 5})
+    assert store.missing(key, days, today=DAY) == [DAY]
+    assert store.free_days(key, days) == [DAY, days[2]]
+
+def test_summary_invalidate_drops_only_that_clinic_and_day():
+    store = DaySummaryStore()
+    a, b = ("clinic-a", 30, "ANY"), ("clinic-b", 30, "ANY")
+    days = [DAY, DAY + timedelta(days=1)]
+    store.update(a, {d: 1 for d in days})
+    store.update(b, {d: 1 for d in days})
+    store.invalidate("clinic-a", days[1])
+    assert store.missing(a, days, today=BEFORE.date()) == [days[1]]
+    assert store.missing(b, days, today=BEFORE.date()) == []
+    store.invalidate("clinic-a")
+    assert store.missing(a, days, today=BEFORE.date()) == days
+
+def test_summary_store_is_bounded(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(availability, "monotonic", lambda: clock[0])
+    store = DaySummaryStore(maxsize=2, ttl=60)
+    for pref in ("DR A", "DR B", "DR C"):
+        store.update(("clinic-a", 30, pref), {DAY: 1})
+    assert store.free_days(("clinic-a", 30, "DR A"), [DAY]) == []
+    assert store.free_days(("clinic-a", 30, "DR C"), [DAY]) == [DAY]
+    clock[0] += 61
+    assert store.free_days(("clinic-a", 30, "DR C"), [DAY]) == []
+
+def test_pref_key_normalizes_client_input():
+    assert pref_key(None) == pref_key("") == "ANY"
+    assert pref_key("  dr tan ") == "DR TAN"
+
+# --- nearest free slot index ---
+from availability import FreeSlotIndex
+
+def make_index():
+    return FreeSlotIndex(
+        {"d1": [at(10), at(9), at(11)], "d2": [at(9, 30), at(10)], "d3": []},
+        {"d1": "Dr One", "d2": "Dr Two", "d3": "Dr Three"},
+    )
+
+def test_doctors_free_at_exact_start():
+    index = make_index()
+    assert sorted(index.doctors_free_at(at(10))) == ["d1", "d2"]
+    assert index.doctors_free_at(at(10, 15)) == []
+
+def test_count_on_day():
+    index = make_index()
+    assert index.count_on_day("d1", DAY) == 3
+    assert index.count_on_day("d1", DAY + timedelta(days=1)) == 0
+    assert index.count_on_day("d3", DAY) == 0
+
+def test_nearest_alternates_around_the_target():
+    index = make_index()
+    assert index.nearest(at(10, 10), 3, after=BEFORE) == [at(10), at(9, 30), at(11)]
+
+def test_nearest_never_returns_slots_at_or_before_after():
+    index = make_index()
+    assert index.nearest(at(9), 5, after=at(9, 30)) == [at(10), at(11)]
@@ -0,0 +1,66 @@
+import asyncio
+import sqlite3
+
+import llm_cache
+from llm_cache import LLMResponseCache, normalize_text
+
+def fake_clock(monkeypatch, start=1_000_000.0):
+    clock = [start]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock[0])
+    return clock
+
+def test_normalize_text_ignores_case_spacing_and_punctuation():
+    assert normalize_text("Tomorrow,  10am!") == normalize_text("tomorrow 10am")
+    assert normalize_text("  See Dr. Tan at 3:30pm. ") == "see dr. tan at 3:30pm"
+
+def test_memory_only_get_put(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    cache = LLMResponseCache("t", maxsize=2, ttl=60)
+    assert cache.get("a") is None
+    cache.put("a", {"v": 1})
+    assert cache.get("a") == {"v": 1}
+    clock[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+def test_memory_is_lru_bounded():
+    cache = LLMResponseCache("t", maxsize=2)
+    for k in "abc":
+        cache.put(k, {"k": k})
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 2
+
+def test_sqlite_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    LLMResponseCache("t", sqlite_path=path).put("a", {"v": 1})
+    warm = LLMResponseCache("t", sqlite_path=path)
+    assert warm.get("a") == {"v": 1}
+    # Namespaces do not see each other's rows
+    assert LLMResponseCache("other", sqlite_path=path).get("a") is None
+
+def test_async_api_reads_through_to_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = LLMResponseCache("t", maxsize=1, sqlite_path=path)
+    async def run():
+        await cache.aput("a", {"v": 1})
+        await cache.aput("b", {"v": 2})
+        # "a" was evicted from memory but is still on disk
+        return await cache.aget("a"), await cache.aget("missing")
+    assert asyncio.run(run()) == ({"v": 1}, None)
+
+def test_expired_disk_rows_are_ignored_and_pruned(tmp_path, monkeypatch):
+    clock = fake_clock(monkeypatch)
+    path = str(tmp_path / "cache.db")
+    LLMResponseCache("t", ttl=60, sqlite_path=path).put("old", {"v": 1})
+    clock[0] += 61
+    restarted = LLMResponseCache("t", ttl=60, sqlite_path=path)
+    assert restarted.get("old") is None
+    assert sqlite3.connect(path).execute("SELECT count(*) FROM llm_cache").fetchone()[0] == 0
+
+def test_invalidate_removes_memory_and_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = LLMResponseCache("t", sqlite_path=path)
+    cache.put("a", {"v": 1})
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert LLMResponseCache("t", sqlite_path=path).get("a") is None
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import outbox
+from outbox import RateLimiter, claim_batch, record_results, send_one
+
+# --- rate limiting ---
+def test_rate_limiter_spaces_reservations(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(outbox.time, "monotonic", lambda: clock[0])
+    limiter = RateLimiter(rate=4)
+    assert [round(limiter.reserve(), 3) for _ in range(4)] == [0.0, 0.25, 0.5, 0.75]
+    # An idle limiter does not bank unused slots
+    clock[0] += 10
+    assert limiter.reserve() <= 0
+    assert round(limiter.reserve(), 3) == 0.25
+
+def test_rate_limiters_are_shared_per_process():
+    assert set(outbox.rate_limiters) == set(outbox.CHANNEL_LIMITS)
+    async def grab():
+        return outbox.channel_semaphores(), outbox.channel_semaphores()
+    first, again = asyncio.run(grab())
+    assert first is again
+    # asyncio semaphores cannot cross event loops, so a new loop (a new Celery task) gets its own
+    other, _ = asyncio.run(grab())
+    assert other is not first
+
+# --- claim / lease / results ---
+NOW = datetime(2030, 1, 7, 9, 0)
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+    models.OutboundMessage.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    monkeypatch.setattr(outbox, "datetime", type("FrozenDatetime", (datetime,), {"utcnow": staticmethod(lambda: NOW)}))
+    yield session
+    session.close()
+
+def add(db, id, status="pending", due=NOW - timedelta(seconds=1), attempts=0, channel="telegram", sensitive=False):
+    db.add(models.OutboundMessage(id=id, channel=channel, recipient="1", body=f"body {id}", sensitive=sensitive,
+                                  status=status, attempts=attempts, next_attempt_at=due))
+    db.commit()
+
+def test_claim_takes_due_rows_under_a_lease(db):
+    add(db, 1)
+    add(db, 2, status="sending", due=NOW - timedelta(seconds=5))  # lease of a dead dispatcher ran out
+    add(db, 3, status="sending", due=NOW + timedelta(seconds=60))  # still leased
+    add(db, 4, due=NOW + timedelta(minutes=5))  # backing off
+    add(db, 5, status="sent")
+    claimed = claim_batch(db, limit=10)
+    assert sorted(m.id for m in claimed) == [1, 2]
+    assert all(m.status == "sending" and m.attempts == 1 for m in claimed)
+    assert all(m.next_attempt_at == NOW + timedelta(seconds=outbox.OUTBOX_LEASE_SECONDS) for m in claimed)
+    # Claimed rows are detached and readable after the claim committed
+    assert claimed[0].body.startswith("body")
+    assert claim_batch(db, limit=10) == []
+
+def test_claim_respects_the_limit_in_id_order(db):
+    for i in range(1, 6): add(db, i)
+    assert [m.id for m in claim_batch(db, limit=2)] == [1, 2]
+    assert [m.id for m in claim_batch(db, limit=10)] == [3, 4, 5]
+
+def test_record_results(db):
+    add(db, 1); add(db, 2); add(db, 3, sensitive=True); add(db, 4)
+    add(db, 5, attempts=outbox.OUTBOX_MAX_ATTEMPTS - 1)
+    claimed = {m.id: m for m in claim_batch(db, limit=10)}
+    record_results(db, [
+        (claimed[1], ("retry", "HTTP 503")),
+        (claimed[2], ("failed", "HTTP 400")),
+        (claimed[3], ("sent", None)),
+        (claimed[4], ("mocked", None)),
+        (claimed[5], ("retry", "HTTP 503")),
+    ])
+    rows = {m.id: m for m in db.query(models.OutboundMessage).all()}
+    assert (rows[1].status, rows[1].next_attempt_at, rows[1].last_error) == ("pending", NOW + timedelta(seconds=60), "HTTP 503")
+    assert rows[2].status == "failed" and rows[2].body == "body 2"
+    assert (rows[3].status, rows[3].sent_at, rows[3].body) == ("sent", NOW, "[redacted]")
+    assert rows[4].status == "mocked"
+    assert rows[5].status == "failed"
+
+# --- sending ---
+def message(channel="telegram"):
+    return models.OutboundMessage(id=1, channel=channel, recipient="42", body="hello", sensitive=False)
+
+def send(handler, msg):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await send_one(client, RateLimiter(1000), asyncio.Semaphore(1), msg)
+    return asyncio.run(run())
+
+def test_unconfigured_provider_is_mocked(monkeypatch):
+    monkeypatch.delenv("TELEGRAM_BOT_TOKEN", raising=False)
+    assert send(lambda request: pytest.fail("no request expected"), message()) == ("mocked", None)
+
+def test_rate_limited_send_is_retried_in_place(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "token")
+    responses = iter([httpx.Response(429, json={"parameters": {"retry_after": 0.01}}), httpx.Response(200, json={"ok": True})])
+    assert send(lambda request: next(responses), message()) == ("sent", None)
+
+def test_client_error_is_final(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "token")
+    status, error = send(lambda request: httpx.Response(400, text="chat not found"), message())
+    assert status == "failed" and error.startswith("HTTP 400")
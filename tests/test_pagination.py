@@ -0,0 +1,113 @@
+import base64
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import models
+from main import encode_calendar_cursor, decode_calendar_cursor
+
+# --- calendar keyset cursor ---
+def test_calendar_cursor_round_trips():
+    stage_id = uuid.uuid4()
+    event = models.CalendarEvent(scheduled_time=datetime(2030, 1, 7, 9, 30), stage_id=stage_id)
+    assert decode_calendar_cursor(encode_calendar_cursor(event)) == (datetime(2030, 1, 7, 9, 30), stage_id)
+
+def test_calendar_cursor_is_url_safe():
+    event = models.CalendarEvent(scheduled_time=datetime(2030, 1, 7, 9, 30), stage_id=uuid.uuid4())
+    cursor = encode_calendar_cursor(event)
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+@pytest.mark.parametrize("cursor", ["not-base64!", base64.urlsafe_b64encode(b"2030-01-07T09:30:00").decode(),
+                                    base64.urlsafe_b64encode(b"yesterday|" + str(uuid.uuid4()).encode()).decode()])
+def test_bad_calendar_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_calendar_cursor(cursor)
+    assert e.value.status_code == 400
+
+# --- developer clinic list ---
+from fastapi import Response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import main
+from main import encode_clinic_cursor, decode_clinic_cursor, get_all_clinics
+
+def test_clinic_cursor_round_trips_names_with_separators():
+    clinic_id = uuid.uuid4()
+    clinic = models.Clinic(name="Klinik A|B (KL)", id=clinic_id)
+    assert decode_clinic_cursor(encode_clinic_cursor(clinic)) == ("Klinik A|B (KL)", clinic_id)
+
+def test_bad_clinic_cursor_is_a_400():
+    with pytest.raises(HTTPException) as e:
+        decode_clinic_cursor(base64.urlsafe_b64encode(b"no separator").decode())
+    assert e.value.status_code == 400
+
+@pytest.fixture
+def clinics_db(monkeypatch):
+    """SQLite copy of the three tables the clinic list reads; the list cache is off so every call hits the query."""
+    monkeypatch.setattr(main, "CLINIC_LIST_CACHE_TTL_SECONDS", 0)
+    engine = create_engine("sqlite://")
+    for model in (models.Clinic, models.User, models.ClinicStaff):
+        model.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+    for i, name in enumerate(["Gamma Clinic", "Alpha Clinic", "Beta Medical", "Delta Clinic"]):
+        clinic = models.Clinic(id=uuid.uuid4(), name=name, registration_number=f"REG-{i}")
+        db.add(clinic)
+        db.add(models.User(ic_passport_number=f"A{i}", name=f"ADMIN {i}", email=f"a{i}@x.com"))
+        db.add(models.ClinicStaff(ic_passport_number=f"A{i}", clinic_id=clinic.id, role="primary_admin", status="active"))
+        if name == "Beta Medical":
+            db.add(models.User(ic_passport_number="T1", name="TEMP", email="t@x.com"))
+            db.add(models.ClinicStaff(ic_passport_number="T1", clinic_id=clinic.id, role="temporary_admin", status="inactive"))
+            db.add(models.User(ic_passport_number="D1", name="DOCTOR", email="d@x.com"))
+            db.add(models.ClinicStaff(ic_passport_number="D1", clinic_id=clinic.id, role="doctor", status="active"))
+    db.commit()
+    yield db
+    db.close()
+
+def principal(role):
+    # get_current_user hands routes a detached User with the staff role set on it
+    user = models.User(ic_passport_number="dev")
+    user.role = role
+    return user
+
+DEVELOPER = principal("developer")
+
+def list_clinics(db, **params):
+    response = Response()
+    return get_all_clinics(response, db=db, current_user=DEVELOPER, **params), response.headers.get("X-Next-Cursor")
+
+def test_lists_every_clinic_with_its_admin_pair(clinics_db):
+    clinics, next_cursor = list_clinics(clinics_db)
+    assert [c["name"] for c in clinics] == ["Alpha Clinic", "Beta Medical", "Delta Clinic", "Gamma Clinic"]
+    assert next_cursor is None
+    beta = clinics[1]
+    assert beta["admin"] == {"ic": "A2", "name": "ADMIN 2", "email": "a2@x.com", "status": "active"}
+    assert beta["temp_admin"] == {"ic": "T1", "name": "TEMP", "email": "t@x.com", "status": "inactive"}
+    assert clinics[0]["temp_admin"] is None
+
+def test_pages_follow_the_cursor(clinics_db):
+    page, cursor = list_clinics(clinics_db, limit=3)
+    assert [c["name"] for c in page] == ["Alpha Clinic", "Beta Medical", "Delta Clinic"] and cursor
+    page, cursor = list_clinics(clinics_db, limit=3, cursor=cursor)
+    assert [c["name"] for c in page] == ["Gamma Clinic"] and cursor is None
+
+def test_search_matches_name_or_registration_number(clinics_db):
+    assert [c["name"] for c in list_clinics(clinics_db, q="clinic")[0]] == ["Alpha Clinic", "Delta Clinic", "Gamma Clinic"]
+    assert [c["name"] for c in list_clinics(clinics_db, q="reg-2")[0]] == ["Beta Medical"]
+
+@pytest.mark.parametrize("q", ["%", "_", "reg_2", "\\"])
+def test_search_wildcards_match_literally(clinics_db, q):
+    assert list_clinics(clinics_db, q=q)[0] == []
+
+def test_search_finds_names_containing_wildcards(clinics_db):
+    clinics_db.add(models.Clinic(id=uuid.uuid4(), name="100% Care_Clinic", registration_number="REG_9"))
+    clinics_db.commit()
+    assert [c["name"] for c in list_clinics(clinics_db, q="100%")[0]] == ["100% Care_Clinic"]
+    assert [c["name"] for c in list_clinics(clinics_db, q="reg_")[0]] == ["100% Care_Clinic"]
+
+def test_only_developers_may_list_clinics(clinics_db):
+    with pytest.raises(HTTPException) as e:
+        get_all_clinics(Response(), db=clinics_db, current_user=principal("primary_admin"))
+    assert e.value.status_code == 403
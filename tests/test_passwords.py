@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+
+import bcrypt
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import main
+import models
+import passwords
+from database import get_async_db
+from passwords import HashingBusy, HashingPool, code_digest, needs_rehash, verify_code_digest
+
+# --- rehash on login ---
+def test_hash_at_the_old_cost_needs_rehash(monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 5)
+    old = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4)).decode()
+    current = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=5)).decode()
+    assert needs_rehash(old)
+    assert not needs_rehash(current)
+
+@pytest.mark.parametrize("stored", ["plaintext-password", "", "$2b$"])
+def test_non_bcrypt_values_need_rehash(stored):
+    assert needs_rehash(stored)
+
+# --- verification codes ---
+def test_code_digest_round_trips():
+    stored = code_digest("IC1", "123456")
+    assert asyncio.run(verify_code_digest("IC1", "123456", stored))
+
+@pytest.mark.parametrize("ic, code", [("IC1", "123457"), ("IC2", "123456")])
+def test_wrong_code_or_user_fails(ic, code):
+    assert not asyncio.run(verify_code_digest(ic, code, code_digest("IC1", "123456")))
+
+# --- back-pressure ---
+@pytest.fixture
+def saturated_pool(monkeypatch):
+    """A pool whose only queue slot is taken; no worker process is ever started."""
+    monkeypatch.setattr(passwords, "HASH_QUEUE_TIMEOUT_SECONDS", 0.05)
+    pool = HashingPool(1, max_pending=1)
+    pool._slots.acquire()
+    yield pool
+    pool._slots.release()
+
+def test_saturated_pool_raises_hashing_busy(saturated_pool):
+    with pytest.raises(HashingBusy):
+        saturated_pool.run(passwords._hashpw, b"secret", 4)
+    with pytest.raises(HashingBusy):
+        asyncio.run(saturated_pool.run_async(passwords._hashpw, b"secret", 4))
+    assert saturated_pool._executor is None
+
+@pytest.fixture
+def client(monkeypatch, saturated_pool):
+    """The app on an in-memory SQLite database holding one active staff member, with the hashing pool saturated."""
+    monkeypatch.setattr(passwords, "hashing_pool", saturated_pool)
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            for model in (models.Clinic, models.User, models.ClinicStaff):
+                await conn.run_sync(model.__table__.create)
+        async with Session() as db:
+            clinic_id = uuid.uuid4()
+            db.add(models.Clinic(id=clinic_id, name="Alpha Clinic", registration_number="REG-1"))
+            db.add(models.User(ic_passport_number="S1", name="STAFF ONE", email="s1@x.com", password_hash=bcrypt.hashpw(b"tmp_1234", bcrypt.gensalt(rounds=4)).decode()))
+            db.add(models.ClinicStaff(ic_passport_number="S1", clinic_id=clinic_id, role="staff", status="active"))
+            await db.commit()
+    asyncio.run(setup())
+
+    async def override():
+        async with Session() as db:
+            yield db
+    main.app.dependency_overrides[get_async_db] = override
+    yield TestClient(main.app)
+    main.app.dependency_overrides.pop(get_async_db, None)
+    asyncio.run(engine.dispose())
+
+def test_busy_hashing_pool_is_a_503(client):
+    r = client.post("/admin/force-reset", json={"email": "s1@x.com", "temp_password": "tmp_1234", "new_password": "new-secret", "clinic_id": "c1"})
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "2"
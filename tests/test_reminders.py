@@ -0,0 +1,106 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import celery_worker
+import models
+from celery_worker import claim_due_reminders, clinic_timezones
+
+# 08:00 in Kuala Lumpur (UTC+8), 00:00 in London (UTC+0 in January)
+NOW_UTC = datetime(2030, 1, 7, 0, 0, tzinfo=timezone.utc)
+KL, LONDON = "Asia/Kuala_Lumpur", "Europe/London"
+
+@pytest.fixture
+def db(monkeypatch):
+    """SQLite copy of the tables the reminder claim joins, with the clock frozen at NOW_UTC."""
+    engine = create_engine("sqlite://")
+    for model in (models.Clinic, models.Patient, models.Appointment, models.ApptStage):
+        model.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    monkeypatch.setattr(celery_worker, "datetime", type("FrozenDatetime", (datetime,), {"now": staticmethod(lambda tz=None: NOW_UTC.astimezone(tz))}))
+    yield session
+    session.close()
+
+def add_clinic(db, tz):
+    clinic = models.Clinic(id=uuid.uuid4(), name=f"Clinic {tz}", timezone=tz)
+    db.add(clinic)
+    patient = models.Patient(ic_passport_number=f"P-{clinic.id.hex[:8]}", clinic_id=clinic.id, name="PATIENT", telegram_id=42)
+    db.add(patient)
+    appt = models.Appointment(id=uuid.uuid4(), clinic_id=clinic.id, patient_ic=patient.ic_passport_number)
+    db.add(appt)
+    db.commit()
+    return appt
+
+def add_stage(db, appt, local_time, reminder_sent=None):
+    stage = models.ApptStage(id=uuid.uuid4(), appointment_id=appt.id, stage_name="Consultation", scheduled_time=local_time,
+                             status="scheduled", reminder_sent=reminder_sent)
+    db.add(stage)
+    db.commit()
+    return stage.id
+
+def claim(db, tz, lead):
+    rows = claim_due_reminders(db, tz, lead)
+    db.commit()
+    return [r[0] for r in rows]
+
+def marker(db, stage_id):
+    db.expire_all()
+    return db.get(models.ApptStage, stage_id).reminder_sent
+
+def test_each_stage_is_claimed_once_per_lead(db):
+    appt = add_clinic(db, KL)
+    stage = add_stage(db, appt, datetime(2030, 1, 8, 7, 0))
+    assert claim(db, KL, 1440) == [stage]
+    assert claim(db, KL, 1440) == []
+    assert marker(db, stage) == 1440
+
+def test_stage_entering_the_closer_window_is_claimed_again(db):
+    appt = add_clinic(db, KL)
+    stage = add_stage(db, appt, datetime(2030, 1, 7, 9, 30), reminder_sent=1440)
+    assert claim(db, KL, 120) == [stage]
+    assert marker(db, stage) == 120
+
+def test_two_hour_marker_is_never_downgraded_by_the_day_pass(db):
+    appt = add_clinic(db, KL)
+    stage = add_stage(db, appt, datetime(2030, 1, 7, 9, 0))
+    # Closer leads run first, as in run_reminder_agent
+    assert claim(db, KL, 120) == [stage]
+    assert claim(db, KL, 1440) == []
+    assert marker(db, stage) == 120
+
+def test_unreminded_past_and_out_of_window_stages_are_skipped(db):
+    appt = add_clinic(db, KL)
+    past = add_stage(db, appt, datetime(2030, 1, 7, 7, 0))
+    far = add_stage(db, appt, datetime(2030, 1, 9, 9, 0))
+    assert claim(db, KL, 1440) == []
+    assert marker(db, past) is None and marker(db, far) is None
+
+def test_due_window_uses_each_clinics_local_time(db):
+    kl_stage = add_stage(db, add_clinic(db, KL), datetime(2030, 1, 7, 9, 30))
+    # 01:30 is already past in Kuala Lumpur but 90 minutes away in London
+    london_stage = add_stage(db, add_clinic(db, LONDON), datetime(2030, 1, 7, 1, 30))
+    assert sorted(clinic_timezones(db)) == [KL, LONDON]
+    assert claim(db, KL, 120) == [kl_stage]
+    assert claim(db, LONDON, 120) == [london_stage]
+
+def test_clinic_without_timezone_uses_the_default(db):
+    appt = add_clinic(db, KL)
+    # Rows from before the column existed are NULL (the ORM default would fill it in on insert)
+    db.query(models.Clinic).update({"timezone": None})
+    db.commit()
+    stage = add_stage(db, appt, datetime(2030, 1, 7, 9, 30))
+    assert clinic_timezones(db) == [models.DEFAULT_TIMEZONE]
+    assert claim(db, models.DEFAULT_TIMEZONE, 120) == [stage]
+
+def test_queued_reminder_keeps_the_agent_log_action(db):
+    appt = add_clinic(db, KL)
+    add_stage(db, appt, datetime(2030, 1, 7, 9, 30))
+    [row] = claim_due_reminders(db, KL, 120)
+    log = celery_worker.queue_reminder(db, row, 120)
+    assert log["action"] == "Reminder Sent" and "2h reminder" in log["reasoning"]
+    # The outbox row is only added to the session; run_reminder_agent commits it together with the claim
+    [msg] = [m for m in db.new if isinstance(m, models.OutboundMessage)]
+    assert msg.recipient == "42" and msg.status == "pending"
@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+import database
+from database import ReplicaRouter
+
+@pytest.fixture
+def replica(monkeypatch):
+    """A SQLite stand-in for the replica whose reported lag the test controls (NULL = WAL receiver not streaming)."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE replica_lag (lag REAL)"))
+        conn.execute(text("INSERT INTO replica_lag VALUES (0)"))
+    clock = [1000.0]
+    monkeypatch.setattr(database, "DATABASE_REPLICA_URL", "postgresql://replica/db")
+    monkeypatch.setattr(database, "REPLICA_LAG_SQL", text("SELECT lag FROM replica_lag"))
+    monkeypatch.setattr(database, "get_replica_engine", lambda: engine)
+    monkeypatch.setattr(database, "monotonic", lambda: clock[0])
+
+    class Replica:
+        def set_lag(self, lag):
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE replica_lag SET lag = :lag"), {"lag": lag})
+        def tick(self, seconds=database.REPLICA_LAG_CHECK_SECONDS):
+            clock[0] += seconds
+    return Replica()
+
+def test_unconfigured_replica_is_never_used(monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_REPLICA_URL", None)
+    router = ReplicaRouter()
+    assert router.use_replica() is False
+    assert router.snapshot()["configured"] is False
+
+def test_replica_within_lag_budget_is_used(replica):
+    replica.set_lag(database.REPLICA_MAX_LAG_SECONDS - 1)
+    router = ReplicaRouter()
+    assert router.use_replica() is True
+    assert router.snapshot()["replica_reads"] == 1
+
+def test_lagging_replica_falls_back_to_primary(replica):
+    replica.set_lag(database.REPLICA_MAX_LAG_SECONDS + 1)
+    router = ReplicaRouter()
+    assert router.use_replica() is False
+    assert router.snapshot()["primary_fallbacks"] == 1
+
+def test_replica_that_is_not_streaming_is_unusable(replica):
+    replica.set_lag(None)
+    router = ReplicaRouter()
+    assert router.use_replica() is False
+    assert router.snapshot()["last_error"] == "WAL receiver is not streaming"
+
+def test_unreachable_replica_falls_back_and_records_the_error(replica, monkeypatch):
+    def broken():
+        raise ConnectionError("replica down")
+    monkeypatch.setattr(database, "get_replica_engine", broken)
+    router = ReplicaRouter()
+    assert router.use_replica() is False
+    assert router.snapshot()["last_error"] == "replica down"
+
+def test_lag_is_rechecked_only_after_the_interval(replica):
+    router = ReplicaRouter()
+    assert router.use_replica() is True
+    replica.set_lag(database.REPLICA_MAX_LAG_SECONDS + 1)
+    # Still the last reading until the check interval has passed
+    assert router.use_replica() is True
+    replica.tick()
+    assert router.use_replica() is False
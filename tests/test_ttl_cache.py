@@ -0,0 +1,55 @@
+from datetime import date
+
+import ttl_cache
+from ttl_cache import TTLCache
+from availability import SlotCache
+
+def fake_clock(monkeypatch, start=1000.0):
+    clock = [start]
+    monkeypatch.setattr(ttl_cache, "monotonic", lambda: clock[0])
+    return clock
+
+def test_get_put_and_stats():
+    cache = TTLCache(maxsize=4, ttl=60)
+    assert cache.get(("a",)) is None
+    cache.put(("a",), 1)
+    assert cache.get(("a",)) == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+def test_entries_expire(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    cache = TTLCache(ttl=30)
+    cache.put(("a",), 1)
+    clock[0] += 29
+    assert cache.get(("a",)) == 1
+    clock[0] += 2
+    assert cache.get(("a",)) is None
+    assert cache.stats()["size"] == 0
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put(("a",), 1)
+    cache.put(("b",), 2)
+    cache.get(("a",))
+    cache.put(("c",), 3)
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == 1 and cache.get(("c",)) == 3
+
+def test_clear():
+    cache = TTLCache()
+    cache.put(("q", None, 50), [1])
+    cache.clear()
+    assert cache.get(("q", None, 50)) is None
+
+def test_slot_cache_invalidates_by_clinic_and_day():
+    cache = SlotCache()
+    d1, d2 = date(2030, 1, 7), date(2030, 1, 8)
+    for clinic in ("c1", "c2"):
+        for d in (d1, d2):
+            cache.put((clinic, d, 30, "ANY"), [clinic, d])
+    cache.invalidate("c1", d1)
+    assert cache.get(("c1", d1, 30, "ANY")) is None
+    assert cache.get(("c1", d2, 30, "ANY")) is not None
+    cache.invalidate("c1")
+    assert cache.get(("c1", d2, 30, "ANY")) is None
+    assert cache.get(("c2", d1, 30, "ANY")) is not None
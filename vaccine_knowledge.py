@@ -0,0 +1,96 @@
+import os
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+import models
+from llm_cache import LLMResponseCache, normalize_text
+
+# --- VACCINE KNOWLEDGE CACHE ---
+# Persistent answers for /admin/ai/vaccine-schedule. Vaccines already in the catalog are answered from their own
+# rows (source='catalog'); everything else is the LLM's answer stored once (source='llm').
+# A small in-process LRU sits in front so repeat keystroke searches never touch the database either.
+_memo = LLMResponseCache("vaccine_knowledge", maxsize=2000, ttl=3600)
+# LLM answers are re-asked after this long; catalog rows never expire (they are refreshed on every edit)
+LLM_ANSWER_TTL = timedelta(days=float(os.getenv("VACCINE_KNOWLEDGE_LLM_TTL_DAYS", "30")))
+# Only answers that name a real vaccine are worth keeping; "invalid" is mostly half-typed keystroke searches
+STORED_STATUSES = ("exact_match", "multiple_options")
+MAX_KEY_LENGTH = 255
+
+def knowledge_key(text: str) -> str:
+    """normalize_text, with anything too long for query_key replaced by its digest."""
+    key = normalize_text(text)
+    if len(key) <= MAX_KEY_LENGTH: return key
+    return "sha256:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def expired(row: models.VaccineKnowledge) -> bool:
+    if row.source != 'llm': return False
+    # Rows stored before "invalid" answers stopped being kept count as expired too
+    return row.payload.get("status") not in STORED_STATUSES or (row.updated_at is not None and row.updated_at < datetime.utcnow() - LLM_ANSWER_TTL)
+
+def catalog_payload(vaccine: models.Vaccine, schedules: list) -> dict:
+    return {
+        "status": "exact_match",
+        "options": [],
+        "type": vaccine.type,
+        "total_doses": vaccine.total_doses,
+        "has_booster": vaccine.has_booster,
+        "schedules": [{"dose_number": s.dose_number, "interval_description": s.interval_description} for s in sorted(schedules, key=lambda s: s.dose_number or 0)]
+    }
+
+def _upsert(db: Session, key: str, payload: dict, source: str, vaccine_id=None):
+    row = db.query(models.VaccineKnowledge).filter_by(query_key=key).first()
+    if row:
+        row.payload, row.source, row.vaccine_id = payload, source, vaccine_id
+    else:
+        db.add(models.VaccineKnowledge(query_key=key, payload=payload, source=source, vaccine_id=vaccine_id))
+    _memo.invalidate(key)
+
+def seed_from_catalog(db: Session):
+    """Make sure every catalog vaccine has a knowledge row; LLM rows for the same name are replaced.
+    Expired LLM rows are pruned here (at startup); until then lookup() ignores them."""
+    db.query(models.VaccineKnowledge).filter(
+        models.VaccineKnowledge.source == 'llm',
+        or_(models.VaccineKnowledge.updated_at < datetime.utcnow() - LLM_ANSWER_TTL,
+            models.VaccineKnowledge.payload["status"].astext.notin_(STORED_STATUSES))
+    ).delete(synchronize_session=False)
+    vaccines = db.query(models.Vaccine).all()
+    schedules = {}
+    for s in db.query(models.VaccineDoseSchedule).all():
+        schedules.setdefault(s.vaccine_id, []).append(s)
+    existing = {r.query_key: r.source for r in db.query(models.VaccineKnowledge.query_key, models.VaccineKnowledge.source).all()}
+    for v in vaccines:
+        key = knowledge_key(v.name or "")
+        if key and existing.get(key) != 'catalog':
+            _upsert(db, key, catalog_payload(v, schedules.get(v.id, [])), 'catalog', v.id)
+    db.commit()
+
+def lookup(db: Session, search_query: str):
+    key = knowledge_key(search_query)
+    payload = _memo.get(key)
+    if payload is not None: return payload
+    row = db.query(models.VaccineKnowledge).filter_by(query_key=key).first()
+    if row is None or expired(row): return None
+    _memo.put(key, row.payload)
+    return row.payload
+
+def store_llm_answer(db: Session, search_query: str, payload: dict):
+    if payload.get("status") not in STORED_STATUSES: return
+    key = knowledge_key(search_query)
+    _upsert(db, key, payload, 'llm')
+    db.commit()
+    _memo.put(key, payload)
+
+def refresh_vaccine(db: Session, vaccine_id: int, old_name: str = None):
+    """Call after a vaccine or its dose schedule is edited, before commit."""
+    db.flush()
+    v = db.query(models.Vaccine).filter_by(id=vaccine_id).first()
+    if old_name and (not v or knowledge_key(old_name) != knowledge_key(v.name or "")):
+        db.query(models.VaccineKnowledge).filter_by(query_key=knowledge_key(old_name), source='catalog').delete(synchronize_session=False)
+        _memo.invalidate(knowledge_key(old_name))
+    if v and v.name:
+        schedules = db.query(models.VaccineDoseSchedule).filter_by(vaccine_id=vaccine_id).all()
+        _upsert(db, knowledge_key(v.name), catalog_payload(v, schedules), 'catalog', v.id)
+
+def stats() -> dict:
+    return _memo.stats()